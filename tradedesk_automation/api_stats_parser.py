@@ -0,0 +1,46 @@
+# api_stats_parser module
+# Module holds the class => APIStatsParser - parses the 'TradeDesk API stats:' comment posted to child tickets
+# Class responsible for recognising the api stats comment and pulling the block of stat lines that follows its header
+# into a ticket level dictionary, the patterns are compiled once and tolerate extra whitespace and any number of stat
+# lines. A comment without any stat line is not an api stats comment, there is nothing to bill from it.
+#
+import re
+
+
+class APIStatsParser(object):
+    def __init__(self, header='TradeDesk API stats:'):
+        # header must be the first non-blank line of the comment body
+        self.header_pattern = re.compile(r'\A\s*' + re.escape(header) + r'[ \t]*(?:\r?\n|\Z)')
+        # a stat line is 'name: value', the stats are the lines following the header (blank lines before the first one
+        # are skipped) up to the first line that is not a stat
+        self.stat_pattern = re.compile(r'[ \t]*([^:\r\n]+?)[ \t]*:[ \t]*(\S.*?)[ \t]*\r?')
+
+    # Returns a dictionary of stat name => value when the comment body is an api stats comment with at least one stat
+    # line, otherwise None
+    #
+    def parse(self, body):
+        if not body:
+            return None
+        header = self.header_pattern.match(body)
+        if header is None:
+            return None
+        ticket_level_dict = {}
+        for line in body[header.end():].split('\n'):
+            stat = self.stat_pattern.fullmatch(line)
+            if stat is None:
+                if ticket_level_dict or line.strip():
+                    break
+                continue
+            ticket_level_dict[stat.group(1)] = stat.group(2)
+        return ticket_level_dict or None
+
+    # Scans the comments (raw dicts, newest first) and stops at the first api stats comment, returns the comment body
+    # and its stats dictionary, or None, None when no comment matches
+    #
+    def search(self, comments):
+        for comment in comments:
+            body = comment.get('body')
+            ticket_level_dict = self.parse(body)
+            if ticket_level_dict is not None:
+                return body, ticket_level_dict
+        return None, None
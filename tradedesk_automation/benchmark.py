@@ -0,0 +1,546 @@
+# benchmark module
+# Module holds the classes => FakeJiraServer - a local stand-in for the Jira REST api used by JiraManager,
+#                             FakeSMTPSink - a local smtp server that accepts and discards every message,
+#                             BenchmarkManager - runs TTDAttachmentManager.process_manager end to end against them
+# The fake servers run in a separate process, seeded with a synthetic workload of N parents x M children x K comments
+# and optional injected latency and error rates, so the benchmark never touches production Jira or the mailhost and
+# the client side peak memory is not polluted by the servers. The run reports tickets/sec, requests per ticket and
+# peak memory as json, and when given a baseline report from an earlier commit fails on a regression past a threshold.
+#   python benchmark.py --parents 50 --children 2 --comments 20 --latency-ms 5 --output bench.json
+#   python benchmark.py --baseline bench.json --threshold 10
+#
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import socketserver
+import multiprocessing
+import argparse
+import tempfile
+import tracemalloc
+import threading
+import logging
+import random
+import json
+import time
+import sys
+import re
+
+
+class FakeJiraServer(object):
+    # the Jira user's timezone, deliberately not UTC (nor, most likely, the host's) so timestamps have to be compared
+    # with their offsets
+    jira_timezone = timezone(timedelta(hours=-5))
+    jira_date_format = '%Y-%m-%dT%H:%M:%S.%f%z'
+
+    def __init__(self, parents=10, children=1, comments=10, stats_ratio=0.9, latency_ms=0.0, error_rate=0.0,
+                 error_status=500, retry_after=None, fail_after_write=False, seed=42):
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_after_write = fail_after_write   # injected errors on writes land after the write is applied
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.issues = {}            # issue key => issue json
+        self.comments = {}          # issue key => list of comment json, oldest first
+        self.attachments = {}       # issue key => list of attachment json, served as the issue's 'attachment' field
+        self.stats = {'requests': 0, 'bytes': 0, 'errors': 0, 'by_endpoint': {}}
+        self.stats_lock = threading.Lock()
+        self.server = None
+        self.base_url = ""
+        self.generate(parents, children, comments, stats_ratio)
+
+    # Builds the synthetic workload, every child ticket is in 'Post Processing' and, for stats_ratio of them, the
+    # newest comment is the 'TradeDesk API stats:' comment
+    #
+    def generate(self, parents, children, comments, stats_ratio):
+        updated = self.jira_time(timedelta(days=-1))
+        issue_id = 10000
+        for p in range(parents):
+            parent_key = 'CAM-{}'.format(issue_id)
+            self.issues[parent_key] = self.issue_json(issue_id, parent_key, 'Trade Desk TTD Licensing {}'.format(p),
+                                                      'Open', updated, None)
+            issue_id += 1
+            for c in range(children):
+                child_key = 'CAM-{}'.format(issue_id)
+                self.issues[child_key] = self.issue_json(issue_id, child_key, 'Weekly delivery {}'.format(c),
+                                                         'Post Processing', updated, self.issues[parent_key])
+                self.comments[child_key] = [self.comment_json(n, 'Automated status update {}\nnothing to report'
+                                                              .format(n), updated) for n in range(comments)]
+                if comments and self.random.random() < stats_ratio:
+                    self.comments[child_key][-1] = self.comment_json(
+                        comments - 1, 'TradeDesk API stats:\nMatched IDs: {}\nTotal IDs: {}'
+                        .format(self.random.randint(1000, 99999), self.random.randint(100000, 999999)), updated)
+                issue_id += 1
+
+    @staticmethod
+    def issue_json(issue_id, key, summary, status, updated, parent):
+        fields = {'summary': summary, 'status': {'name': status}, 'updated': updated, 'duedate': None,
+                  'reporter': {'key': 'automation', 'name': 'automation'}, 'issuetype': {'name': 'Opportunity'}}
+        if parent is not None:
+            fields['parent'] = {'id': parent['id'], 'key': parent['key'],
+                                'fields': {'summary': parent['fields']['summary']}}
+        return {'id': str(issue_id), 'key': key, 'fields': fields}
+
+    @staticmethod
+    def comment_json(comment_id, body, created):
+        return {'id': str(comment_id), 'body': body, 'created': created, 'updated': created,
+                'author': {'key': 'automation', 'name': 'automation'}}
+
+    # Starts the http server on a free local port in a background thread, returns the base url
+    #
+    def start(self, host='127.0.0.1', port=0):
+        jira = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                jira.handle(self, 'GET')
+
+            def do_POST(self):
+                jira.handle(self, 'POST')
+
+            def do_PUT(self):
+                jira.handle(self, 'PUT')
+
+            def do_DELETE(self):
+                jira.handle(self, 'DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.base_url = 'http://{}:{}'.format(host, self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, name='fake-jira', daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    # Dispatches one request, applying the injected latency and error rate to every api call, an injected error on a
+    # write is returned after the write was applied when fail_after_write is set (a 503 from a proxy that lost the
+    # answer), otherwise every injected error is returned before the request is handled
+    #
+    def handle(self, request, method):
+        url = urlparse(request.path)
+        params = parse_qs(url.query)
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else b''
+        path = url.path.rstrip('/')
+
+        if path == '/_stats':
+            with self.stats_lock:
+                self.stats['completed'] = sum(1 for issue in self.issues.values()
+                                              if issue['fields']['status']['name'] == 'Complete')
+                return self.respond(request, 200, self.stats, count=False)
+
+        if self.latency:
+            time.sleep(self.latency)
+        inject_error = self.error_rate and self.random.random() < self.error_rate
+        error = {'errorMessages': ['Injected failure'], 'errors': {}}
+        if inject_error and not (self.fail_after_write and method in ('POST', 'PUT')):
+            return self.respond(request, self.error_status, error, path='injected error')
+
+        routes = (
+            (r'/rest/api/2/serverInfo', self.server_info),
+            (r'/rest/api/2/field', self.fields_list),
+            (r'/rest/api/2/search', self.search),
+            (r'/rest/api/2/issue/([^/]+)/comment', self.comment),
+            (r'/rest/api/2/issue/([^/]+)/attachments', self.attachment),
+            (r'/rest/api/2/issue/([^/]+)/transitions', self.transition),
+            (r'/rest/api/2/issue/([^/]+)', self.issue),
+        )
+        for pattern, route in routes:
+            match = re.fullmatch(pattern, path)
+            if match:
+                status, payload = route(method, params, body, *match.groups())
+                if inject_error:
+                    return self.respond(request, self.error_status, error, path='injected error after write')
+                return self.respond(request, status, payload, path=pattern)
+        return self.respond(request, 404, {'errorMessages': ['Not found: {}'.format(path)], 'errors': {}}, path=path)
+
+    # Writes the json response and counts it against the endpoint
+    #
+    def respond(self, request, status, payload, count=True, path=''):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        request.send_response(status)
+        if status in (429, 503) and self.retry_after is not None:
+            request.send_header('Retry-After', str(self.retry_after))
+        request.send_header('Content-Type', 'application/json;charset=UTF-8')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+        if count:
+            with self.stats_lock:
+                self.stats['requests'] += 1
+                self.stats['bytes'] += len(data)
+                self.stats['errors'] += 1 if status >= 400 else 0
+                endpoint = self.stats['by_endpoint'].setdefault('{} {}'.format(request.command, path),
+                                                                {'requests': 0, 'bytes': 0})
+                endpoint['requests'] += 1
+                endpoint['bytes'] += len(data)
+
+    def server_info(self, method, params, body):
+        return 200, {'baseUrl': self.base_url, 'version': '7.13.0', 'versionNumbers': [7, 13, 0],
+                     'deploymentType': 'Server', 'serverTitle': 'Fake Jira'}
+
+    def fields_list(self, method, params, body):
+        return 200, []
+
+    # Answers the query shapes JiraManager sends: the parent 'Summary ~' search, the 'Parent in (...)' search and the
+    # pending sub-task count, honouring startAt/maxResults and keyset paging, the 'updated >=' watermark clause and the
+    # requested fields
+    #
+    def search(self, method, params, body):
+        if method == 'POST' and body:
+            params = {name: [value] if not isinstance(value, list) else value
+                      for name, value in json.loads(body.decode('utf-8')).items()}
+        jql = params.get('jql', [''])[0]
+        start_at = int(params.get('startAt', ['0'])[0])
+        max_results = int(params.get('maxResults', ['50'])[0])
+        fields = self.requested_fields(params)
+
+        parent_match = re.search(r'Parent in \(([^)]*)\)', jql, re.I)
+        if parent_match:
+            parent_keys = {key.strip() for key in parent_match.group(1).split(',')}
+            matches = [issue for issue in self.issues.values()
+                       if 'parent' in issue['fields'] and issue['fields']['parent']['key'] in parent_keys
+                       and issue['fields']['status']['name'] == 'Post Processing']
+        elif 'subTaskIssueTypes()' in jql:
+            matches = [issue for issue in self.issues.values()
+                       if 'parent' in issue['fields'] and issue['fields']['status']['name'] == 'Post Processing']
+        else:
+            matches = [issue for issue in self.issues.values()
+                       if 'parent' not in issue['fields'] and issue['fields']['status']['name'] in ('Open', 'Reopened')]
+
+        # relative 'updated >= "-Nm"' as sent by RunStateManager, measured back from the server's clock
+        updated_match = re.search(r'updated >= "-(\d+)m"', jql)
+        if updated_match:
+            watermark = datetime.now(timezone.utc) - timedelta(minutes=int(updated_match.group(1)))
+            matches = [issue for issue in matches
+                       if datetime.strptime(issue['fields']['updated'], self.jira_date_format) >= watermark]
+
+        # keyset paging: 'key > X ... ORDER BY key ASC' as sent by JiraManager.iter_child_tickets
+        key_match = re.search(r'key > ([A-Z]+-\d+)', jql)
+        if key_match:
+            last_key = self.key_number(key_match.group(1))
+            matches = [issue for issue in matches if self.key_number(issue['key']) > last_key]
+        if re.search(r'ORDER BY key', jql, re.I):
+            matches = sorted(matches, key=lambda issue: self.key_number(issue['key']))
+
+        page = [self.project(issue, fields) for issue in matches[start_at:start_at + max_results]]
+        return 200, {'startAt': start_at, 'maxResults': max_results, 'total': len(matches), 'issues': page}
+
+    @staticmethod
+    def key_number(key):
+        return int(key.rsplit('-', 1)[1])
+
+    def issue(self, method, params, body, key):
+        issue = self.issues.get(key) or self.issue_by_id(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        if method == 'PUT':
+            issue['fields'].update(json.loads(body.decode('utf-8')).get('fields', {}))
+            self.touch(issue)
+            return 204, None
+        return 200, self.project(issue, self.requested_fields(params))
+
+    # Comments newest first when asked with orderBy=-created, with startAt/maxResults paging, or adds a new comment
+    #
+    def comment(self, method, params, body, key):
+        issue = self.issues.get(key) or self.issue_by_id(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        comments = self.comments.setdefault(issue['key'], [])
+        if method == 'POST':
+            now = self.touch(issue)
+            comment = self.comment_json(len(comments), json.loads(body.decode('utf-8')).get('body', ''), now)
+            comments.append(comment)
+            return 201, comment
+        ordered = list(reversed(comments)) if params.get('orderBy', [''])[0] == '-created' else comments
+        start_at = int(params.get('startAt', ['0'])[0])
+        max_results = int(params.get('maxResults', ['50'])[0])
+        return 200, {'startAt': start_at, 'maxResults': max_results, 'total': len(comments),
+                     'comments': ordered[start_at:start_at + max_results]}
+
+    # Accepts one or more multipart 'file' parts in a single upload
+    #
+    def attachment(self, method, params, body, key):
+        issue = self.issues.get(key) or self.issue_by_id(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        file_names = [name.decode('utf-8') for name in re.findall(rb'filename="([^"]+)"', body)]
+        attachments = self.attachments.setdefault(issue['key'], [])
+        now = self.touch(issue)
+        added = [{'id': str(n), 'filename': file_name, 'size': len(body), 'created': now,
+                  'self': '{}/rest/api/2/attachment/{}'.format(self.base_url, n)}
+                 for n, file_name in enumerate(file_names, len(attachments))]
+        attachments.extend(added)
+        return 200, added
+
+    # Transition 471 moves the ticket to 'Complete', fields sent with the transition are applied to the issue
+    #
+    def transition(self, method, params, body, key):
+        issue = self.issues.get(key) or self.issue_by_id(key)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist'], 'errors': {}}
+        if method == 'GET':
+            return 200, {'transitions': [{'id': '471', 'name': 'Complete', 'to': {'name': 'Complete'}}]}
+        data = json.loads(body.decode('utf-8'))
+        issue['fields'].update(data.get('fields', {}))
+        if str(data.get('transition', {}).get('id')) == '471':
+            issue['fields']['status'] = {'name': 'Complete'}
+        self.touch(issue)
+        return 204, None
+
+    def issue_by_id(self, issue_id):
+        return next((issue for issue in self.issues.values() if issue['id'] == issue_id), None)
+
+    @classmethod
+    def touch(cls, issue):
+        issue['fields']['updated'] = cls.jira_time()
+        return issue['fields']['updated']
+
+    # Jira's timestamp format, in the Jira user's timezone with its offset
+    #
+    @classmethod
+    def jira_time(cls, delta=timedelta(0)):
+        jira_now = datetime.now(cls.jira_timezone) + delta
+        return jira_now.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}'.format(jira_now.microsecond // 1000) + \
+            jira_now.strftime('%z')
+
+    @staticmethod
+    def requested_fields(params):
+        fields = [field.strip() for value in params.get('fields', []) for field in value.split(',') if field.strip()]
+        return None if not fields or '*all' in fields else set(fields)
+
+    # Returns the issue json restricted to the requested fields, with the self link pointing back at this server and
+    # the uploaded attachments as the 'attachment' field
+    #
+    def project(self, issue, fields):
+        projected = dict(issue, self='{}/rest/api/2/issue/{}'.format(self.base_url, issue['id']))
+        projected['fields'] = dict(issue['fields'], attachment=list(self.attachments.get(issue['key'], [])))
+        if fields is not None:
+            projected['fields'] = {name: value for name, value in projected['fields'].items() if name in fields}
+        return projected
+
+
+class FakeSMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.messages = 0
+        self.sessions = 0
+        self.sink_lock = threading.Lock()
+        super().__init__((host, port), FakeSMTPHandler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-smtp', daemon=True).start()
+        return self.server_address[1]
+
+
+# Minimal smtp conversation: greets, accepts every sender/recipient and every DATA block, then discards it
+#
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        with self.server.sink_lock:
+            self.server.sessions += 1
+        self.reply('220 fake-smtp ESMTP ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith('EHLO'):
+                self.wfile.write(b'250-fake-smtp\r\n250 8BITMIME\r\n')
+            elif command.startswith('DATA'):
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                with self.server.sink_lock:
+                    self.server.messages += 1
+                self.reply('250 OK queued')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+    def reply(self, text):
+        self.wfile.write(text.encode('utf-8') + b'\r\n')
+
+
+# Runs both fake servers in a child process, sends the urls back through the pipe and serves until told to stop,
+# the smtp counts are published through the fake Jira '/_stats' endpoint
+#
+def serve_fakes(connection, workload):
+    jira = FakeJiraServer(**workload)
+    smtp = FakeSMTPSink()
+    jira_url = jira.start()
+    smtp_port = smtp.start()
+    jira.stats['smtp'] = {'messages': 0, 'sessions': 0}
+
+    def publish_smtp():
+        while True:
+            with jira.stats_lock:
+                jira.stats['smtp'] = {'messages': smtp.messages, 'sessions': smtp.sessions}
+            time.sleep(0.05)
+    threading.Thread(target=publish_smtp, daemon=True).start()
+
+    connection.send((jira_url, smtp_port))
+    connection.recv()
+    jira.stop()
+    smtp.shutdown()
+
+
+class BenchmarkManager(object):
+    def __init__(self, args):
+        self.args = args
+        self.workload = {'parents': args.parents, 'children': args.children, 'comments': args.comments,
+                         'stats_ratio': args.stats_ratio, 'latency_ms': args.latency_ms,
+                         'error_rate': args.error_rate, 'error_status': args.error_status,
+                         'retry_after': args.retry_after, 'fail_after_write': args.fail_after_write,
+                         'seed': args.seed}
+        self.logger = logging.getLogger(__name__)
+
+    # Starts the fakes, runs the process manager once end to end and returns the benchmark report
+    #
+    def run(self):
+        parent_end, child_end = multiprocessing.Pipe()
+        fakes = multiprocessing.Process(target=serve_fakes, args=(child_end, self.workload), daemon=True)
+        fakes.start()
+        jira_url, smtp_port = parent_end.recv()
+        try:
+            with tempfile.TemporaryDirectory() as results_dir:
+                config_params = self.config_params(jira_url, smtp_port, results_dir + '/')
+                # imported here so the fake servers' process never loads the jira client
+                from trade_desk_attachment_manager import TTDAttachmentManager
+
+                tracemalloc.start()
+                start = time.perf_counter()
+                ttd_attach = TTDAttachmentManager(config_params)
+                ttd_attach.process_manager()
+                seconds = time.perf_counter() - start
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            server_stats = self.server_stats(jira_url)
+        finally:
+            parent_end.send('stop')
+            fakes.join(5)
+
+        tickets = self.args.parents * self.args.children
+        return {
+            'workload': self.workload,
+            'parallel': self.args.parallel,
+            'max_workers': self.args.max_workers,
+            'seconds': round(seconds, 4),
+            'tickets': tickets,
+            'tickets_per_sec': round(tickets / seconds, 3) if seconds else None,
+            'requests': server_stats['requests'],
+            'requests_per_ticket': round(server_stats['requests'] / tickets, 3) if tickets else None,
+            'response_bytes': server_stats['bytes'],
+            'bytes_per_ticket': round(server_stats['bytes'] / tickets, 1) if tickets else None,
+            'server_errors': server_stats['errors'],
+            'tickets_completed': server_stats['completed'],
+            'emails': server_stats['smtp']['messages'],
+            'smtp_sessions': server_stats['smtp']['sessions'],
+            'peak_memory_bytes': peak_memory,
+            'by_endpoint': server_stats['by_endpoint'],
+            'operations': ttd_attach.metrics.summary()['operations']
+        }
+
+    # Same configuration dictionary main.main builds from config.ini, pointed at the fakes
+    #
+    def config_params(self, jira_url, smtp_port, results_dir):
+        return {
+            "jira_url":             jira_url,
+            "jira_token":           ('benchmark', 'benchmark'),
+            "jira_max_retries":     self.args.max_retries,
+            "pending_check":        True,
+            "jql_parent_type":      "'Opportunity'",
+            "jql_parent_status":    "(Open, Reopened)",
+            "jql_parent_text":      "\"'Trade Desk TTD Licensing'\"",
+            "jql_child_status":     "('Post Processing')",
+            "results_json_path":    results_dir,
+            "results_json_name":    'benchmark',
+            "app_name":             'benchmark',
+            "profile":              '',
+            "incremental":          False,
+            "history_store":        True,
+            "email_to":             'finance@example.com',
+            "email_from":           'automation@example.com',
+            "smtp_host":            '127.0.0.1',
+            "smtp_port":            smtp_port,
+            "email_batch":          self.args.email_batch,
+            "parallel_mode":        self.args.parallel,
+            "max_workers":          self.args.max_workers
+        }
+
+    @staticmethod
+    def server_stats(jira_url):
+        # give the smtp publisher one cycle to catch up with the last message
+        time.sleep(0.1)
+        from urllib.request import urlopen
+        with urlopen(jira_url + '/_stats') as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    # Compares the report with a baseline report, returns the list of regressions past the threshold percent
+    #
+    @staticmethod
+    def regressions(report, baseline, threshold):
+        failures = []
+        limit = threshold / 100.0
+        if baseline.get('workload') != report['workload']:
+            return ['workload {} differs from baseline {}'.format(report['workload'], baseline.get('workload'))]
+        if baseline.get('tickets_per_sec') and report['tickets_per_sec'] < baseline['tickets_per_sec'] * (1 - limit):
+            failures.append('tickets/sec {} < baseline {}'.format(report['tickets_per_sec'],
+                                                                  baseline['tickets_per_sec']))
+        for metric in ('requests_per_ticket', 'bytes_per_ticket', 'peak_memory_bytes'):
+            if baseline.get(metric) and report[metric] > baseline[metric] * (1 + limit):
+                failures.append('{} {} > baseline {}'.format(metric, report[metric], baseline[metric]))
+        return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the Trade Desk attachment automation')
+    parser.add_argument('--parents', type=int, default=20)
+    parser.add_argument('--children', type=int, default=1)
+    parser.add_argument('--comments', type=int, default=10)
+    parser.add_argument('--stats-ratio', type=float, default=0.9, help='share of child tickets with api stats')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='injected latency per Jira request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of Jira requests answered with a 500')
+    parser.add_argument('--error-status', type=int, default=500, help='http status of an injected error')
+    parser.add_argument('--retry-after', type=float, help='Retry-After seconds sent with injected 429/503s')
+    parser.add_argument('--fail-after-write', action='store_true',
+                        help='apply writes before answering them with an injected error')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--max-retries', type=int, default=5, help='Jira request retries per call')
+    parser.add_argument('--parallel', action='store_true')
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--email-batch', action='store_true')
+    parser.add_argument('--output', help='write the json report to this file')
+    parser.add_argument('--baseline', help='json report of an earlier commit to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s')
+    report = BenchmarkManager(args).run()
+    print(json.dumps({name: value for name, value in report.items() if name not in ('by_endpoint', 'operations')},
+                     indent=4))
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            failures = BenchmarkManager.regressions(report, json.load(fp), args.threshold)
+        for failure in failures:
+            print('REGRESSION: {}'.format(failure))
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# credential_cache_manager module
+# Module holds the class => CredentialCacheManager - manages the local cache of the Vault credential
+# Class responsible for keeping the Jira secret fetched from Vault in a local file readable by the run account only
+# (0600 in a 0700 directory) for ttl_seconds, so back to back runs skip the Vault round trip. A cache file that is too
+# old, unreadable, not owned by the run account or open to group/other is ignored and replaced with a fresh fetch, and
+# invalidate drops the cache when Jira refuses the cached secret.
+#
+import stat
+import json
+import time
+import os
+import logging
+
+
+class CredentialCacheManager(object):
+    def __init__(self, cache_file_name, ttl_seconds=3600):
+        self.cache_file_name = os.path.expanduser(cache_file_name)
+        self.ttl_seconds = ttl_seconds
+        self.logger = logging.getLogger(__name__)
+
+    # Returns (secret, True) from a fresh cache, otherwise (fetch(), False) after caching the fetched secret, a ttl of
+    # 0 or None switches the cache off
+    #
+    def get(self, fetch):
+        if self.ttl_seconds:
+            secret = self.read()
+            if secret is not None:
+                return secret, True
+        secret = fetch()
+        if self.ttl_seconds:
+            try:
+                self.write(secret)
+            except OSError as e:
+                self.logger.warning("The credential cache {} could not be written => {}"
+                                    .format(self.cache_file_name, e))
+        return secret, False
+
+    # Removes the cached secret
+    #
+    def invalidate(self):
+        try:
+            os.remove(self.cache_file_name)
+        except FileNotFoundError:
+            pass
+
+    # Reads the cached secret, None when missing, expired, unreadable or not private to the run account
+    #
+    def read(self):
+        try:
+            fd = os.open(self.cache_file_name, os.O_RDONLY)
+        except OSError:
+            return None
+        with os.fdopen(fd, 'r') as fp:
+            file_stat = os.fstat(fp.fileno())
+            if file_stat.st_uid != os.getuid() or file_stat.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                self.logger.warning("The credential cache {} is not private to this account, ignoring it"
+                                    .format(self.cache_file_name))
+                return None
+            try:
+                cached = json.load(fp)
+                if time.time() - float(cached['fetched']) > self.ttl_seconds:
+                    return None
+                return cached['secret']
+            except (ValueError, KeyError, TypeError):
+                return None
+
+    # Writes the secret through a private temporary file replaced into place, so no reader sees a partial file
+    #
+    def write(self, secret):
+        cache_dir = os.path.dirname(self.cache_file_name) or '.'
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        temp_file_name = '{}.{}.tmp'.format(self.cache_file_name, os.getpid())
+        fd = os.open(temp_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                os.fchmod(fp.fileno(), 0o600)
+                json.dump({'secret': secret, 'fetched': time.time()}, fp)
+            os.replace(temp_file_name, self.cache_file_name)
+        except OSError:
+            try:
+                os.remove(temp_file_name)
+            except OSError:
+                pass
+            raise
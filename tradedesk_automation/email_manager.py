@@ -1,33 +1,87 @@
 # email module
 # Module holds the class => EmailManager - manages the email creation and the smtp interface
-# Class responsible for all email related management
+# Class responsible for all email related management, a single smtp session is kept open for the whole run and is
+# transparently reconnected if the server drops it
 #
-from smtplib import SMTP
+from smtplib import SMTP, SMTPServerDisconnected
 from email.message import EmailMessage
+import threading
 
 
 class EmailManager(object):
-    def __init__(self, pixel, subject, to_address, from_address):
-        self.pixel = pixel
-        self.msg = ""
-        self.subj = subject
+    def __init__(self, to_address, from_address, smtp_host='mailhost.valkyrie.net', smtp_port=25):
         self.to_address = to_address
         self.from_address = from_address
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.smtp = None
+        self.queue = []
+        self.smtp_lock = threading.Lock()
 
-    # Create the email in a text format then send via smtp, finally save the email as a StringIO file and return
+    # Create the email in a text format then send via smtp, finally return the email message
     #
-    def cm_emailer(self, results_text):
-        # Simple Text Email
-        self.msg = EmailMessage()
-        self.msg['Subject'] = self.subj
-        self.msg['From'] = self.from_address
-        self.msg['To'] = self.to_address
+    def cm_emailer(self, subject, results_text):
+        msg = self.create_message(subject, results_text)
+        with self.smtp_lock:
+            self.send(msg)
+        return msg
+
+    # Create the email in a text format and hold it for the next send_queued call, returns the email message
+    #
+    def queue_emailer(self, subject, results_text):
+        msg = self.create_message(subject, results_text)
+        with self.smtp_lock:
+            self.queue.append(msg)
+        return msg
+
+    # Sends every queued email over the shared session, returns the list of messages that could not be sent
+    #
+    def send_queued(self):
+        failed = []
+        with self.smtp_lock:
+            queued, self.queue = self.queue, []
+            for msg in queued:
+                try:
+                    self.send(msg)
+                except Exception:
+                    failed.append(msg)
+        return failed
+
+    # Simple Text Email
+    #
+    def create_message(self, subject, results_text):
+        msg = EmailMessage()
+        msg['Subject'] = subject
+        msg['From'] = self.from_address
+        msg['To'] = self.to_address
 
         # Message Text
-        self.msg.set_content(results_text)
+        msg.set_content(results_text)
+        return msg
 
-        # Send Email
-        with SMTP('mailhost.valkyrie.net') as smtp:
-            smtp.send_message(self.msg)
+    # Send over the open session, a dropped connection is reopened once and the message is resent
+    #
+    def send(self, msg):
+        try:
+            self.session().send_message(msg)
+        except SMTPServerDisconnected:
+            self.smtp = None
+            self.session().send_message(msg)
 
-        return self.msg
+    # Opens the smtp session on first use and returns it
+    #
+    def session(self):
+        if self.smtp is None:
+            self.smtp = SMTP(self.smtp_host, self.smtp_port)
+        return self.smtp
+
+    # Ends the smtp session
+    #
+    def close(self):
+        with self.smtp_lock:
+            if self.smtp is not None:
+                try:
+                    self.smtp.quit()
+                except SMTPServerDisconnected:
+                    pass
+                self.smtp = None
@@ -1,87 +1,298 @@
 # jira_manager module
 # Module holds the class => JiraManager - manages JIRA ticket interface
 # Class responsible for all JIRA related interactions including ticket searching, data pull, file attaching, comment
-# posting and field updating.
+# posting and field updating. The jira client is only imported, and its session (with the server info and field list
+# round trips made when it is built) only created, on first use, so a run that finds nothing pending never pays for it.
 #
-from jira import JIRA
+from requests.structures import CaseInsensitiveDict
+import requests
 from datetime import date
+from io import BytesIO
+import threading
+from jira_request_manager import JiraRequestManager
 
 
 class JiraManager(object):
-    def __init__(self, url, jira_token):
+    def __init__(self, url, jira_token, max_retries=5):
         self.tickets = []
-        self.jira = JIRA(url, basic_auth=jira_token)
+        self.url = url
+        self.jira_token = jira_token
+        self.jira_client = None
+        self.http = None
+        self.session_lock = threading.Lock()
+        self.response_hooks = []            # requests response hooks added to each session as it is created
+        self.requests = JiraRequestManager(max_retries=max_retries)
         self.comments = ""
         self.title = ""
         self.today_date = date.today().strftime('%Y-%m-%d')     # format required for Jira date field
         self.api_results_fail_alert = 'Could not find any api results for this run.'
         self.ticket_transitionid = '471'    # 'Complete' w/ Rev-Rec
+        self.complete_status = 'Complete'
+        self.page_size = 100                # Jira caps a single search page at 100 issues by default
+        self.jql_max_length = 2000          # keep each JQL string safely under the server/url length limit
+        # only the fields the automation reads are requested, keeps search and issue payloads small
+        self.parent_fields = 'summary'
+        self.child_fields = 'parent,reporter,duedate,status,updated'
+        self.comment_page_size = 20         # comments are pulled newest first, one page at a time
+        # per-run issue cache, issue key => (updated timestamp, issue), filled by the child ticket searches
+        self.issue_cache = {}
+        self.cache_lock = threading.Lock()
 
-    # Searches Jira for all tickets that match the parent ticket query criteria
+    # The jira client session, created on first use, retries are left to the request manager, which backs off and
+    # throttles across all worker threads, building the client (its server info and field list requests) included
     #
-    def find_tickets(self, search_type, parent_ticket, ticket_type, ticket_status, summary_text):
-        # Query to find corresponding Jira Tickets
-        self.tickets = []
-        if search_type == 'parent':
-            jql_query = "Project in (CAM) AND Type = " + ticket_type + " AND Status in " + ticket_status \
-                        + " AND Summary ~ " + summary_text
-        else:       # this is the jql for the child ticket search
-            jql_query = "Parent in (" + parent_ticket.key + ") AND Status in " + ticket_status
+    @property
+    def jira(self):
+        if self.jira_client is None:
+            with self.session_lock:
+                if self.jira_client is None:
+                    from jira import JIRA
+                    jira_client = self.requests.call('connect', JIRA, self.url, basic_auth=self.jira_token,
+                                                     max_retries=0)
+                    jira_client._session.hooks['response'].extend(self.response_hooks)
+                    self.jira_client = jira_client
+        return self.jira_client
+
+    # Counts the child (sub-task) tickets in the given status with a bare http search that returns no issues, used to
+    # find out whether there is anything to do before the jira client is built
+    #
+    def count_pending(self, ticket_status, extra_clause=""):
+        jql_query = "Project in (CAM) AND issuetype in subTaskIssueTypes() AND Status in " + ticket_status \
+                    + extra_clause
+        return self.requests.call('count', self.search_count, jql_query)
 
-        self.tickets = self.jira.search_issues(jql_query, maxResults=500)
+    def search_count(self, jql_query):
+        if self.http is None:
+            with self.session_lock:
+                if self.http is None:
+                    http = requests.Session()
+                    http.auth = tuple(self.jira_token)
+                    http.hooks['response'].extend(self.response_hooks)
+                    self.http = http
+        response = self.http.get(self.url.rstrip('/') + '/rest/api/2/search',
+                                 params={'jql': jql_query, 'maxResults': 0, 'fields': 'key'}, timeout=30)
+        response.raise_for_status()
+        return response.json()['total']
+
+    # Searches Jira for all tickets that match the parent ticket query criteria
+    #
+    def find_tickets(self, ticket_type, ticket_status, summary_text):
+        # Query to find the parent Jira Tickets, their child tickets are streamed by iter_child_tickets
+        jql_query = "Project in (CAM) AND Type = " + ticket_type + " AND Status in " + ticket_status \
+                    + " AND Summary ~ " + summary_text
+        self.tickets = self.search_all(jql_query, self.parent_fields)
 
         if len(self.tickets) > 0:
             return self.tickets
         else:
             return None
 
+    # Yields the child tickets of every parent ticket one search page at a time, so only a page of issues is held at
+    # once. Pages are read by key ('key > last key ORDER BY key') rather than startAt, as tickets completed while the
+    # stream is being processed leave the result set and would otherwise shift the later pages.
+    #
+    def iter_child_tickets(self, parent_tickets, ticket_status, extra_clause=""):
+        parent_keys = [parent_ticket.key for parent_ticket in parent_tickets]
+        for key_chunk in self.chunk_keys(parent_keys, ticket_status + extra_clause):
+            jql_query = "Parent in (" + ", ".join(key_chunk) + ") AND Status in " + ticket_status + extra_clause
+            last_key = None
+            while True:
+                keyset_clause = " AND key > " + last_key if last_key else ""
+                page = self.requests.call('search', self.jira.search_issues,
+                                          jql_query + keyset_clause + " ORDER BY key ASC", startAt=0,
+                                          maxResults=self.page_size, fields=self.child_fields)
+                self.cache_issues(page)
+                for child_ticket in page:
+                    yield child_ticket
+                if len(page) < self.page_size:
+                    break
+                last_key = page[-1].key
+
+    # Pages through every result of a jql query using startAt, avoids the silent truncation of a single maxResults call
+    #
+    def search_all(self, jql_query, fields=None):
+        tickets = []
+        start_at = 0
+        while True:
+            page = self.requests.call('search', self.jira.search_issues, jql_query, startAt=start_at,
+                                      maxResults=self.page_size, fields=fields)
+            tickets.extend(page)
+            start_at += len(page)
+            if len(page) == 0 or start_at >= page.total:
+                break
+        return tickets
+
+    # Splits the parent keys into groups whose 'Parent in (...)' clause fits within the JQL length limit
+    #
+    def chunk_keys(self, keys, ticket_status):
+        # leave room for the keyset paging clause, ' AND key > <last key> ORDER BY key ASC'
+        base_length = len("Parent in () AND Status in " + ticket_status) + 64
+        chunk, chunk_length = [], base_length
+        for key in keys:
+            key_length = len(key) + 2       # allow for the ', ' separator
+            if chunk and chunk_length + key_length > self.jql_max_length:
+                yield chunk
+                chunk, chunk_length = [], base_length
+            chunk.append(key)
+            chunk_length += key_length
+        if chunk:
+            yield chunk
+
+    # Stores searched issues in the per-run cache keyed by issue key along with their 'updated' timestamp
+    #
+    def cache_issues(self, tickets):
+        with self.cache_lock:
+            for ticket in tickets:
+                self.issue_cache[ticket.key] = (ticket.fields.updated, ticket)
+
+    # Returns the cached issue when its 'updated' timestamp still matches, otherwise fetches the projected fields once
+    # and caches the result for the downstream methods
+    #
+    def get_issue(self, ticket):
+        updated = getattr(ticket.fields, 'updated', None)
+        with self.cache_lock:
+            cached = self.issue_cache.get(ticket.key)
+        if cached is not None and (updated is None or cached[0] == updated):
+            return cached[1]
+        issue = self.requests.call('issue', self.jira.issue, ticket.key, fields=self.child_fields)
+        with self.cache_lock:
+            self.issue_cache[issue.key] = (issue.fields.updated, issue)
+        return issue
+
+    # Drops an issue from the cache once it has been written to, so a later read sees the new server state
+    #
+    def invalidate_issue(self, ticket):
+        with self.cache_lock:
+            self.issue_cache.pop(ticket.key, None)
+
     # Retrieves the required data from parent ticket to populate email
     #
     def information_pull(self, ticket):
-        ticket = self.jira.issue(ticket.key)
-        # find and return the title for the ticket and all the comments (in dict form)
-        self.comments = ticket.fields.comment.comments
+        ticket = self.get_issue(ticket)
+        # find and return the title for the ticket and a lazy newest first reader of the comments (in dict form),
+        # locals are returned so that concurrent callers never read another ticket's values from the shared attributes
+        comments = self.newest_comments(ticket)
         title = str(ticket.fields.parent.fields.summary)
         #print("Is this an ascii string?: {}".format(self.is_ascii(title)))
-        self.title = ''.join(char for char in title if char.isalnum())
+        title = ''.join(char for char in title if char.isalnum())
         #print("{}".format(self.title))
-        return self.comments, self.title
+        self.comments, self.title = comments, title
+        return comments, title
 
-    # Add a comment to ticket informing of no api results
+    # Yields the raw comments of a ticket newest first, a page at a time from the comment endpoint, so a caller that
+    # stops early never downloads the older comments
+    #
+    def newest_comments(self, ticket):
+        start_at = 0
+        while True:
+            page = self.requests.call('comments', self.jira._get_json, 'issue/{}/comment'.format(ticket.key),
+                                      params={'orderBy': '-created', 'startAt': start_at,
+                                              'maxResults': self.comment_page_size})
+            comments = page.get('comments', [])
+            for comment in comments:
+                yield comment
+            start_at += len(comments)
+            if len(comments) == 0 or start_at >= page.get('total', 0):
+                break
+
+    # Add a comment to ticket informing of no api results, returns the comment's 'updated' timestamp
     #
     def add_no_results_comment(self, ticket):
-        cam_ticket = self.jira.issue(ticket.key)
+        cam_ticket = self.get_issue(ticket)
         reporter = cam_ticket.fields.reporter.key
         message = """{api_results_fail_comment}
                   """.format(reporter, api_results_fail_comment=self.api_results_fail_alert)
-        self.jira.add_comment(issue=cam_ticket, body=message)
+        comment = self.requests.call('add_comment', self.jira.add_comment, issue=cam_ticket, body=message,
+                                     idempotent=False,
+                                     already_done=lambda: self.newest_comment_is(cam_ticket, message))
+        self.invalidate_issue(cam_ticket)
+        # the new comment's timestamp is the ticket's 'updated' value after this write
+        return getattr(comment, 'updated', None)
 
-    # Add a text file copy of email as an attachment to ticket
+    # Add a text file copy of email as an attachment to ticket, both file name variants are posted from the same bytes
+    # in one multipart request, falling back to one upload per file if the combined request is rejected
     #
     def add_attachment(self, ticket, email_subject, attachment):
-        email_file_name = "{}.txt.png".format(email_subject)
-        self.jira.add_attachment(issue=ticket, attachment=attachment,
-                                 filename=email_file_name)
-        email_file_name = "{}.txt".format(email_subject)
-        self.jira.add_attachment(issue=ticket, attachment=attachment,
-                                 filename=email_file_name)
+        from jira import JIRAError
+        email_file_names = ["{}.txt.png".format(email_subject), "{}.txt".format(email_subject)]
+        attachment.seek(0)
+        data = attachment.read()
+        try:
+            url = self.jira._get_url('issue/' + str(ticket.key) + '/attachments')
+            files = [('file', (email_file_name, data, 'text/plain')) for email_file_name in email_file_names]
+            self.requests.call('add_attachment', self.jira._session.post, url, files=files,
+                               headers=CaseInsensitiveDict({'content-type': None, 'X-Atlassian-Token': 'nocheck'}),
+                               idempotent=False,
+                               already_done=lambda: self.attachments_exist(ticket, email_file_names))
+        except JIRAError as e:
+            if e.status_code in self.requests.retry_status_codes:
+                raise
+            for email_file_name in email_file_names:
+                self.requests.call('add_attachment', self.jira.add_attachment, issue=ticket,
+                                   attachment=BytesIO(data), filename=email_file_name, idempotent=False,
+                                   already_done=lambda: self.attachments_exist(ticket, [email_file_name]))
+
+    # Set the 'Due Date' to today and transition to 'Complete' in one call by sending the field with the transition,
+    # when the transition screen rejects the field the separate field update and transition are made instead
+    #
+    def complete_ticket(self, ticket):
+        from jira import JIRAError
+        try:
+            self.requests.call('transition_issue', self.jira.transition_issue, ticket.key, self.ticket_transitionid,
+                               fields={'duedate': self.today_date}, idempotent=False,
+                               already_done=lambda: self.is_complete(ticket))
+        except JIRAError as e:
+            if e.status_code != 400:
+                raise
+            self.update_field_value(ticket)
+            self.progress_ticket(ticket)
+        else:
+            self.invalidate_issue(ticket)
 
     # Update the field 'Due Date' in the ticket to today's date
     #
     def update_field_value(self, ticket):
         ticket.fields.due_date = self.today_date
-        ticket.update(fields={'duedate': ticket.fields.due_date})
+        # setting a field to a fixed value is idempotent, safe to retry as is
+        self.requests.call('update', ticket.update, fields={'duedate': ticket.fields.due_date})
+        self.invalidate_issue(ticket)
 
     # Transition the ticket status field to 'Complete'
     #
     def progress_ticket(self, ticket):
-        ticket = self.jira.issue(ticket.key)
-        self.jira.transition_issue(ticket, self.ticket_transitionid)
+        # the transition only needs the issue key, no need to re-fetch the issue
+        self.requests.call('transition_issue', self.jira.transition_issue, ticket.key, self.ticket_transitionid,
+                           idempotent=False, already_done=lambda: self.is_complete(ticket))
+        self.invalidate_issue(ticket)
+
+    # State check for a retried upload, True when every file name is already attached to the ticket
+    #
+    def attachments_exist(self, ticket, file_names):
+        issue = self.jira.issue(ticket.key, fields='attachment')
+        attached = {attachment.filename for attachment in issue.fields.attachment}
+        return all(file_name in attached for file_name in file_names)
+
+    # State check for a retried transition, True when the ticket already has the 'Complete' status
+    #
+    def is_complete(self, ticket):
+        issue = self.jira.issue(ticket.key, fields='status')
+        return issue.fields.status.name == self.complete_status
+
+    # State check for a retried comment, True when the newest comment already carries the message
+    #
+    def newest_comment_is(self, ticket, message):
+        page = self.jira._get_json('issue/{}/comment'.format(ticket.key),
+                                   params={'orderBy': '-created', 'startAt': 0, 'maxResults': 1})
+        comments = page.get('comments', [])
+        return bool(comments) and comments[0].get('body', '').strip() == message.strip()
 
     # Ends the current JIRA session
     #
     def kill_session(self):
-        self.jira.kill_session()
+        if self.jira_client is not None:
+            self.jira_client.kill_session()
+        if self.http is not None:
+            self.http.close()
 
     # Test string for non-ascii characters
     #
@@ -0,0 +1,147 @@
+# jira_request_manager module
+# Module holds the class => JiraRequestManager - manages the retry and throttling of every Jira request
+# Class responsible for the request layer under JiraManager: it retries rate limited (429), unavailable (502/503/504)
+# and dropped requests with jittered exponential backoff, honours the server's Retry-After header, and adapts the gap
+# between requests to the throttling signals (widening on a throttle, easing off after each success) so the run keeps
+# the highest rate the server will sustain. Writes that are not idempotent are only retried after a state check shows
+# the first attempt did not already land. Failures are told apart by their http status code, so the jira client's
+# errors and plain requests errors (the light count-only search) are handled alike without importing the jira client.
+#
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.exceptions import RequestException, ConnectionError, Timeout
+import threading
+import random
+import time
+import logging
+
+
+class JiraRequestManager(object):
+    def __init__(self, max_retries=5, backoff_base=1.0, backoff_max=60.0, max_interval=10.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_interval = max_interval
+        self.retry_status_codes = (429, 502, 503, 504)
+        self.interval = 0.0             # current minimum gap between request starts, adapted to the server
+        self.next_request = 0.0         # monotonic time the next request may start
+        self.throttle_lock = threading.Lock()
+        self.random = random.Random()
+        self.retries = 0
+        self.throttles = 0
+        self.logger = logging.getLogger(__name__)
+
+    # Calls a Jira request function with retries, already_done is a state check used before retrying a write that is
+    # not idempotent, when it reports the write landed the retry is skipped and None is returned
+    #
+    def call(self, operation, func, *args, idempotent=True, already_done=None, **kwargs):
+        attempt = 0
+        while True:
+            self.wait_turn()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                delay = self.backoff(e, attempt)
+                with self.throttle_lock:
+                    self.retries += 1
+                self.logger.warning("{} failed ({}), retry {} of {} in {:.1f}s".format(
+                    operation, self.describe(e), attempt, self.max_retries, delay))
+                time.sleep(delay)
+                # a 429 is refused before the write is applied, any other failure may have landed so check first
+                if not idempotent and already_done is not None and self.status_code(e) != 429 \
+                        and self.check_done(operation, already_done):
+                    self.logger.info("{} had already been applied before the failure, not retrying".format(operation))
+                    return None
+            else:
+                self.ease_off()
+                return result
+
+    # Blocks until the adaptive gap since the previous request start has passed
+    #
+    def wait_turn(self):
+        with self.throttle_lock:
+            now = time.monotonic()
+            start = max(now, self.next_request)
+            self.next_request = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    # After a success the gap shrinks by a fifth, falling to zero once the server stops throttling, so the gap only
+    # keeps growing while more than about a third of the requests are being throttled
+    #
+    def ease_off(self):
+        with self.throttle_lock:
+            self.interval = self.interval * 0.8 if self.interval > 0.005 else 0.0
+
+    # Works out the retry delay: the server's Retry-After when given, otherwise jittered exponential backoff. A
+    # throttle signal also widens the request gap by half and holds back every other thread until the delay is over
+    #
+    def backoff(self, error, attempt):
+        retry_after = self.retry_after(error)
+        if retry_after is None:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+            delay = self.random.uniform(delay / 2, delay)
+        else:
+            delay = min(self.backoff_max, retry_after)
+        if self.status_code(error) in (429, 503):
+            with self.throttle_lock:
+                self.throttles += 1
+                self.interval = min(self.max_interval, max(self.interval * 1.5, 0.02))
+                self.next_request = max(self.next_request, time.monotonic() + delay)
+        return delay
+
+    # Only throttling, gateway/unavailable responses and dropped connections are worth retrying
+    #
+    def is_retryable(self, error):
+        status_code = self.status_code(error)
+        if status_code is not None:
+            return status_code in self.retry_status_codes
+        return isinstance(error, (ConnectionError, Timeout))
+
+    # The http status code of a JIRAError or a requests HTTPError, None for any other failure
+    #
+    @staticmethod
+    def status_code(error):
+        status_code = getattr(error, 'status_code', None)
+        if status_code is None and isinstance(error, RequestException):
+            status_code = getattr(error.response, 'status_code', None)
+        return status_code
+
+    # Reads the Retry-After header in seconds or as an http date, None when absent or unreadable
+    #
+    @staticmethod
+    def retry_after(error):
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+        value = headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    # Runs a state check, a failing check counts as not done so the write is retried
+    #
+    def check_done(self, operation, already_done):
+        try:
+            return bool(self.call(operation + ' state check', already_done))
+        except Exception as e:
+            self.logger.warning("{} state check failed => {}".format(operation, e))
+            return False
+
+    # Short description of a failure for the retry log line
+    #
+    @staticmethod
+    def describe(error):
+        status_code = JiraRequestManager.status_code(error)
+        if status_code is not None:
+            return "HTTP {}".format(status_code)
+        return type(error).__name__
@@ -0,0 +1,194 @@
+# lease_manager module
+# Module holds the class => LeaseManager - manages the lease file that gives one node a profile's work at a time
+# Class responsible for coordinating the ActiveBatch nodes (and the worker processes on each node) through a small json
+# lease file per profile on the shared zfs path. A lease is taken with an exclusive create, holds the owner and an
+# expiry time, and is renewed by a heartbeat thread while the work runs. A node that dies stops renewing, so once the
+# expiry passes another node takes the lease over and picks the profile up, while a live holder keeps every other node
+# out. The holder checks its lease before each ticket and stops as soon as it can no longer vouch for it. A lease can
+# be taken and released again and again (watch mode holds it for one poll at a time), and a completion marker next to
+# the lease tells a node that starts the same scheduled run late that the profile has already been run.
+#
+from datetime import datetime
+import threading
+import socket
+import json
+import time
+import os
+import logging
+
+
+class LeaseManager(object):
+    def __init__(self, lease_dir, lease_name, ttl_seconds=600, owner=None):
+        self.lease_file_name = os.path.join(lease_dir, '{}.lease'.format(lease_name))
+        self.done_file_name = os.path.join(lease_dir, '{}.done'.format(lease_name))
+        self.ttl_seconds = ttl_seconds
+        self.owner = owner or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.expires = 0.0          # local monotonic deadline the lease is known to be held until
+        self.lost = False
+        self.on_lost = None
+        self.stop_event = threading.Event()
+        self.heartbeat = None
+        self.logger = logging.getLogger(__name__)
+
+    # Takes the lease when it is free or its holder let it expire, starting the heartbeat, returns True when held
+    #
+    def acquire(self):
+        current = self.read()
+        if current is not None:
+            if current['expires'] > time.time():
+                self.logger.info("Lease {} is held by {} until {}".format(
+                    self.lease_file_name, current['owner'], self.format_time(current['expires'])))
+                return False
+            if not self.break_stale(current):
+                return False
+        if not self.create():
+            self.logger.info("Lease {} was taken by another node first".format(self.lease_file_name))
+            return False
+        self.logger.info("Lease {} acquired by {}, expires {}".format(
+            self.lease_file_name, self.owner, self.format_time(time.time() + self.ttl_seconds)))
+        self.lost = False
+        self.stop_event.clear()
+        self.heartbeat = threading.Thread(target=self.renew_loop, name='lease', daemon=True)
+        self.heartbeat.start()
+        return True
+
+    # True while the lease is ours and not past the deadline of its last successful renewal
+    #
+    def held(self):
+        return not self.lost and time.monotonic() < self.expires
+
+    # Stops the heartbeat and removes the lease file if it is still ours
+    #
+    def release(self):
+        self.stop_event.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+            self.heartbeat = None
+        current = self.read()
+        if current is not None and current['owner'] == self.owner:
+            try:
+                os.remove(self.lease_file_name)
+            except OSError as e:
+                self.logger.warning("Lease {} could not be removed => {}".format(self.lease_file_name, e))
+            else:
+                self.logger.info("Lease {} released".format(self.lease_file_name))
+        self.expires = 0.0
+
+    # Returns the completion marker (owner and completed time) when the profile was completed by any node within the
+    # last window_seconds, otherwise None, a window of 0 or None switches the check off
+    #
+    def completed_within(self, window_seconds):
+        if not window_seconds:
+            return None
+        try:
+            with open(self.done_file_name, 'r') as fp:
+                done = json.load(fp)
+            done = {'owner': str(done['owner']), 'completed': float(done['completed'])}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.warning("Completion marker {} could not be read => {}".format(self.done_file_name, e))
+            return None
+        return done if time.time() - done['completed'] < window_seconds else None
+
+    # Records that the profile's run completed, written while the lease is held and replaced into place atomically
+    #
+    def mark_complete(self):
+        temp_file_name = '{}.{}'.format(self.done_file_name, self.owner.replace(':', '_'))
+        try:
+            with open(temp_file_name, 'w') as fp:
+                json.dump({'owner': self.owner, 'completed': time.time(),
+                           'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, fp)
+            os.replace(temp_file_name, self.done_file_name)
+        except OSError as e:
+            self.logger.warning("Completion marker {} could not be written => {}".format(self.done_file_name, e))
+
+    # Renews the lease every third of its ttl, so two renewals can fail before it expires
+    #
+    def renew_loop(self):
+        while not self.stop_event.wait(self.ttl_seconds / 3):
+            if not self.renew():
+                self.lost = True
+                self.logger.error("Lease {} has been lost, stopping work".format(self.lease_file_name))
+                if self.on_lost is not None:
+                    self.on_lost()
+                return
+
+    # Pushes the expiry out, False once another owner holds the file, a failed write leaves the lease to expire
+    #
+    def renew(self):
+        try:
+            current = self.read()
+            if current is None or current['owner'] != self.owner:
+                return False
+            self.write(self.lease_file_name + '.' + self.owner.replace(':', '_'), replace=True)
+        except OSError as e:
+            self.logger.warning("Lease {} renewal failed => {}".format(self.lease_file_name, e))
+            return time.monotonic() < self.expires
+        return True
+
+    # Creates the lease file exclusively, False when another node created it first
+    #
+    def create(self):
+        try:
+            self.write(self.lease_file_name, replace=False)
+        except FileExistsError:
+            return False
+        return True
+
+    # Writes the lease content, atomically replacing the lease through a temporary file on renewal
+    #
+    def write(self, file_name, replace):
+        start = time.monotonic()
+        content = json.dumps({'owner': self.owner, 'expires': time.time() + self.ttl_seconds,
+                              'updated': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if replace else os.O_EXCL), 0o644)
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+        if replace:
+            os.replace(file_name, self.lease_file_name)
+        self.expires = start + self.ttl_seconds
+
+    # Moves an expired lease aside so only one of the nodes racing for it can break it. The file moved aside is
+    # checked again, and if another node had renewed or retaken it in the meantime it is put back and we back off
+    #
+    def break_stale(self, stale):
+        stale_file_name = '{}.stale.{}'.format(self.lease_file_name, self.owner.replace(':', '_'))
+        try:
+            os.rename(self.lease_file_name, stale_file_name)
+        except FileNotFoundError:
+            return True
+        try:
+            with open(stale_file_name, 'r') as fp:
+                moved = json.load(fp)
+        except (OSError, ValueError):
+            moved = stale
+        if moved.get('owner') != stale['owner'] or moved.get('expires', 0) > time.time():
+            try:
+                os.link(stale_file_name, self.lease_file_name)
+            except FileExistsError:
+                pass
+            os.remove(stale_file_name)
+            return False
+        self.logger.warning("Lease {} held by {} expired at {}, taking it over".format(
+            self.lease_file_name, stale['owner'], self.format_time(stale['expires'])))
+        os.remove(stale_file_name)
+        return True
+
+    # Reads the lease file, None when there is none, an unreadable lease counts as expired
+    #
+    def read(self):
+        try:
+            with open(self.lease_file_name, 'r') as fp:
+                current = json.load(fp)
+            return {'owner': str(current['owner']), 'expires': float(current['expires'])}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return {'owner': '', 'expires': 0.0}
+
+    @staticmethod
+    def format_time(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
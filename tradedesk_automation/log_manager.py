@@ -0,0 +1,219 @@
+# log_manager module
+# Module holds the class => LogManager - manages the queued, non-blocking writing of the log file to zfs
+# Class responsible for taking the log file writes off the threads doing the work: records are put on a queue by a
+# QueueHandler and a background thread formats them and writes them to the zfs log file in batches, one write and
+# flush per batch. When the share cannot be written the records spill to a local buffer file, which is copied to the
+# zfs log file once the share answers again (retried every retry_seconds and at the end of the run), and buffers left
+# by a run that died are copied on the next start (a buffer still locked by a live writer is left alone). The log is
+# written as text, or as JSON lines carrying the ticket and parent ticket keys of the record for downstream parsing.
+#
+from logging.handlers import QueueHandler
+from datetime import datetime
+import threading
+import logging
+import fcntl
+import queue
+import json
+import time
+import sys
+import os
+
+
+class LogManager(object):
+    text_format = '%(asctime)s: %(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s'
+    text_date_format = '%m/%d/%Y %H:%M:%S'
+    # the ticket (and its parent) the current thread is working on, added to every record it logs
+    ticket_context = threading.local()
+
+    def __init__(self, log_file_name, buffer_dir, json_lines=False, flush_seconds=1.0, batch_size=1000,
+                 retry_seconds=60):
+        self.log_file_name = log_file_name
+        self.buffer_dir = buffer_dir
+        self.buffer_file_name = os.path.join(buffer_dir, os.path.basename(log_file_name))
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.retry_seconds = retry_seconds
+        self.formatter = JsonLinesFormatter() if json_lines else logging.Formatter(self.text_format,
+                                                                                   self.text_date_format)
+        self.queue = queue.Queue()
+        self.handler = QueueHandler(self.queue)
+        self.handler.addFilter(self.add_ticket)
+        self.log_file = None
+        self.buffer_file = None
+        self.spilled = False
+        self.last_retry = 0.0
+        self.writer = None
+
+    # Copies any buffers a previous run left behind, routes the root logger through the queue and starts the writer
+    #
+    def start(self, level=logging.INFO):
+        self.recover()
+        root_logger = logging.getLogger('')
+        root_logger.setLevel(level)
+        root_logger.addHandler(self.handler)
+        self.writer = threading.Thread(target=self.write_loop, name='log-writer', daemon=True)
+        self.writer.start()
+
+    # Writes out everything queued so far, copies a spilled buffer to zfs and closes the files
+    #
+    def stop(self):
+        logging.getLogger('').removeHandler(self.handler)
+        self.queue.put(None)
+        self.writer.join()
+        if self.spilled:
+            self.restore()
+        for log_file in (self.log_file, self.buffer_file):
+            if log_file is not None:
+                try:
+                    log_file.close()
+                except OSError:
+                    pass
+        self.log_file = self.buffer_file = None
+
+    # Marks the ticket the current thread works on, None clears it
+    #
+    @classmethod
+    def set_ticket(cls, ticket_key, parent_key=None):
+        cls.ticket_context.ticket_key = ticket_key
+        cls.ticket_context.parent_key = parent_key
+
+    # Handler filter, runs on the logging thread so the thread's ticket context is added before the record is queued
+    #
+    def add_ticket(self, record):
+        record.ticket_key = getattr(self.ticket_context, 'ticket_key', None)
+        record.parent_key = getattr(self.ticket_context, 'parent_key', None)
+        return True
+
+    # Background writer: a batch is the records queued within flush_seconds of its first record (at most batch_size),
+    # written and flushed together
+    #
+    def write_loop(self):
+        stopping = False
+        while not stopping:
+            try:
+                record = self.queue.get(timeout=self.retry_seconds)
+            except queue.Empty:
+                if self.spilled:
+                    self.restore()
+                continue
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while record is not None:
+                batch.append(self.format(record))
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            stopping = record is None
+            if batch:
+                self.write(''.join(batch))
+
+    # Formats one record as a log line, a record that cannot be formatted is still written
+    #
+    def format(self, record):
+        try:
+            return self.formatter.format(record) + '\n'
+        except Exception as e:
+            return 'Unformattable log record {} => {}\n'.format(record.msg, e)
+
+    # Writes a batch to zfs, or to the local buffer while zfs is unavailable
+    #
+    def write(self, text):
+        if self.spilled and time.monotonic() - self.last_retry > self.retry_seconds:
+            self.restore()
+        if not self.spilled:
+            try:
+                if self.log_file is None:
+                    self.log_file = open(self.log_file_name, 'a')
+                self.log_file.write(text)
+                self.log_file.flush()
+                return
+            except OSError as e:
+                self.report("The log share is unavailable, spilling to {} => {}".format(self.buffer_file_name, e))
+                self.spilled = True
+                self.last_retry = time.monotonic()
+                self.log_file = None
+        try:
+            if self.buffer_file is None:
+                os.makedirs(self.buffer_dir, exist_ok=True)
+                self.buffer_file = open(self.buffer_file_name, 'a')
+                fcntl.flock(self.buffer_file.fileno(), fcntl.LOCK_EX)
+            self.buffer_file.write(text)
+            self.buffer_file.flush()
+        except OSError as e:
+            self.report("The log buffer {} could not be written, {} bytes of log lost => {}".format(
+                self.buffer_file_name, len(text), e))
+
+    # Appends the local buffer to the zfs log file and removes it, the writer goes back to zfs on success
+    #
+    def restore(self):
+        self.last_retry = time.monotonic()
+        if self.buffer_file is not None:
+            self.buffer_file.close()
+            self.buffer_file = None
+        if self.copy_buffer(self.buffer_file_name, self.log_file_name):
+            self.spilled = False
+
+    # Copies the buffers left by earlier runs that could not reach zfs to their log files
+    #
+    def recover(self):
+        try:
+            with os.scandir(self.buffer_dir) as entries:
+                buffers = [entry.name for entry in entries if entry.is_file()]
+        except OSError:
+            return
+        for buffer_name in buffers:
+            self.copy_buffer(os.path.join(self.buffer_dir, buffer_name),
+                             os.path.join(os.path.dirname(self.log_file_name), buffer_name))
+
+    # Appends a buffer file to a zfs log file and removes the buffer, returns True when nothing is left to copy. The
+    # buffer is locked while it is copied, a buffer locked by its writer is skipped
+    #
+    def copy_buffer(self, buffer_file_name, log_file_name):
+        try:
+            buffer_file = open(buffer_file_name, 'r')
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            self.report("The log buffer {} could not be read => {}".format(buffer_file_name, e))
+            return False
+        with buffer_file:
+            try:
+                fcntl.flock(buffer_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            try:
+                text = buffer_file.read()
+                with open(log_file_name, 'a') as log_file:
+                    log_file.write(text)
+                os.remove(buffer_file_name)
+            except OSError as e:
+                self.report("The log buffer {} could not be copied to {} yet => {}".format(buffer_file_name,
+                                                                                           log_file_name, e))
+                return False
+        return True
+
+    # The writer cannot log its own failures, they go to stderr
+    #
+    @staticmethod
+    def report(message):
+        sys.stderr.write('{}: log_manager: {}\n'.format(datetime.now().strftime('%m/%d/%Y %H:%M:%S'), message))
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # One json object per line: time, level, logger, thread, ticket, parent and message (any traceback is already
+    # part of the message, the QueueHandler merges it in before queueing the record)
+    #
+    def format(self, record):
+        entry = {
+            'time':     datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level':    record.levelname,
+            'logger':   record.name,
+            'thread':   record.threadName,
+            'ticket':   getattr(record, 'ticket_key', None),
+            'parent':   getattr(record, 'parent_key', None),
+            'message':  record.getMessage()
+        }
+        return json.dumps(entry)
@@ -15,7 +15,18 @@
 # Required modules:     main.py,
 #                       trade_desk_attachment_manager.py,
 #                       jira_manager.py,
+#                       jira_request_manager.py,
 #                       email_manager.py,
+#                       api_stats_parser.py,
+#                       run_state_manager.py,
+#                       results_store_manager.py,
+#                       retention_manager.py,
+#                       metrics_manager.py,
+#                       watch_manager.py,
+#                       results_file_manager.py,
+#                       lease_manager.py,
+#                       credential_cache_manager.py,
+#                       log_manager.py,
 #                       config.ini
 # Deployed Location:    //prd-use1a-pr-34-ci-operations-01/home/bradley.ruck/Projects/data_enablement_trade_desk_attach/
 # ActiveBatch Trigger:  //prd-09-abjs-01 (V11)/'Jobs, Folders & Plans'/Operations/Report/DE_TDD_Attach/DE_TDD_WedThurFri
@@ -32,25 +43,55 @@
 
 # main module
 # Responsible for reading in the basic configurations settings, creating the log file, and creating and launching
-# The Trade Desk Attachment Manager (TTD-AM), finally it launches the purge_files method to remove log files that
-# are older than a prescribed retention period. A console logger option is offered via keyboard input for development
-# purposes when the main.py script is invoked. For production, import main as a module and launch the main function
-# as main.main(), which uses 'n' as the default input to the the console logger run option.
+# The Trade Desk Attachment Manager (TTD-AM) for each profile, finally it launches the purge_files method to apply the
+# retention policies to the log and results directories. A console logger option is offered via keyboard input for
+# development purposes when the main.py script is invoked. For production, import main as a module and launch the main
+# function as main.main(), which uses 'n' as the default input to the the console logger run option. For the
+# long-running watch mode launch main.main(watch=True), or set enabled = yes in the [Watch] section of config.ini.
+# The licensing partner profiles listed in the [Profiles] section each run in their own worker process, sharing the one
+# Vault credential fetch. Each profile is guarded by a lease file on the shared zfs path, so the ActiveBatch nodes
+# split the profiles between them and take over a profile whose node has stopped renewing its lease.
+# Start up is kept light: the Vault client is only imported when the cached credential has expired, the jira client
+# only when there is work to do, and the startup timings are logged and added to the metrics report. Log records are
+# queued and written to the zfs log share by a background thread, spilling to a local buffer while the share is down.
 #
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import time
 import os
+import re
 import configparser
 import logging
-from VaultClient3 import VaultClient3 as VaultClient
+import cProfile
 
 from trade_desk_attachment_manager import TTDAttachmentManager
+from jira_request_manager import JiraRequestManager
+from watch_manager import WatchManager
+from lease_manager import LeaseManager
+from retention_manager import RetentionManager
+from credential_cache_manager import CredentialCacheManager
+from log_manager import LogManager
 
+# profile section options => the config_params they override
+profile_options = {
+    "parent_type":      "jql_parent_type",
+    "parent_status":    "jql_parent_status",
+    "parent_text":      "jql_parent_text",
+    "child_status":     "jql_child_status",
+    "email_to":         "email_to"
+}
 
-# Define a console logger for development purposes
+
+# Define a console logger for development purposes, once per process (a worker process runs start_logging for each
+# profile it is given)
 #
 def console_logger():
+    if any(handler.get_name() == 'console' for handler in logging.getLogger('').handlers):
+        return
     # define Handler that writes DEBUG or higher messages to the sys.stderr
     console = logging.StreamHandler()
+    console.set_name('console')
     console.setLevel(logging.DEBUG)
     # set a simple format for console use
     formatter = logging.Formatter('%(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s')
@@ -59,57 +100,294 @@ def console_logger():
     logging.getLogger('').addHandler(console)
 
 
-def main(con_opt='n'):
+# Route all logging through the queue to the log file, written on a background thread, returns the LogManager to stop
+# at the end of the run
+#
+def start_logging(log_file_name, log_options, console):
+    log_manager = LogManager(log_file_name, log_options['buffer_path'], log_options['json_lines'],
+                             log_options['flush_seconds'])
+    log_manager.start(logging.INFO)
+    if console:
+        console_logger()
+    return log_manager
+
+
+# Read the retention policy of a log or results directory, blank or missing values switch that policy off
+#
+def retention_policy(config, section, default_pattern):
+    def optional_float(option):
+        value = config.get(section, option, fallback='').strip()
+        return float(value) if value else None
+
+    return {
+        "purge_days":       optional_float('retention_days'),
+        "max_total_mb":     optional_float('max_total_mb'),
+        "compress_days":    optional_float('compress_days'),
+        "pattern":          config.get(section, 'retention_pattern', fallback=default_pattern)
+    }
+
+
+# Read the licensing partner profiles, profile name => config_params with the [Profile <name>] overrides applied. With
+# no profiles listed the [Jira] query runs on its own under the app name, as before profiles were introduced
+#
+def profile_params(config, config_params):
+    names = config.get('Profiles', 'names', fallback='').replace(',', ' ').split()
+    if not names:
+        return {'default': config_params}
+
+    profiles = {}
+    for name in names:
+        # profile names end up in file names matched by the retention patterns, so keep them to word characters
+        if not re.match(r'^\w+$', name):
+            raise ValueError("Profile name '{}' may only hold letters, digits and underscores".format(name))
+        section = 'Profile {}'.format(name)
+        if not config.has_section(section):
+            raise ValueError("Profile '{}' has no [{}] section in config.ini".format(name, section))
+        params = dict(config_params, results_json_name='{}_{}'.format(config_params['results_json_name'], name),
+                      profile=name)
+        for option, param in profile_options.items():
+            if config.has_option(section, option):
+                params[param] = config.get(section, option)
+        profiles[name] = params
+    return profiles
+
+
+# Fetch the Jira secret, from the local credential cache while it is fresh, otherwise from Vault, returns the secret and
+# whether it came from the cache
+#
+def jira_credential(credential_options, refresh=False):
+    cache = CredentialCacheManager(credential_options['cache_file'], credential_options['ttl_seconds'])
+    if refresh:
+        cache.invalidate()
+
+    def vault_secret():
+        from VaultClient3 import VaultClient3 as VaultClient
+        return VaultClient("prod").VaultSecret('jira', credential_options['authorization'])
+    return cache.get(vault_secret)
+
+
+# Runs one profile under its lease, in a worker process or inline when there is a single profile, returns the profile
+# outcome ('complete' or 'skipped' when another node holds the lease)
+#
+def run_profile(profile_name, config_params, run_options, inline=False):
+    # a worker process logs to its own profile log file, inline the main log file is already set up
+    if inline:
+        return run_leased_profile(profile_name, config_params, run_options)
+    log_manager = start_logging('{}{}_{}.log'.format(run_options['log_file_path'], config_params['results_json_name'],
+                                                     run_options['today_date']),
+                                run_options['logging'], run_options['console'])
+    try:
+        return run_leased_profile(profile_name, config_params, run_options)
+    finally:
+        log_manager.stop()
+
+
+# Runs one profile once its lease is acquired, returns 'skipped' when another node holds the lease or has already
+# completed this run of the profile. Batch and watch mode share the profile's lease, so a ticket is never worked on by
+# both: a batch run holds it for the whole run, watch mode takes it for one poll at a time (see WatchManager)
+#
+def run_leased_profile(profile_name, config_params, run_options):
+    logger = logging.getLogger(__name__)
+    file_prefix = '{}{}'.format(run_options['log_file_path'], config_params['results_json_name'])
+
+    lease = LeaseManager(run_options['lease_path'], config_params['results_json_name'], run_options['lease_ttl'])
+    if not run_options['watch']:
+        if not lease.acquire():
+            logger.info("Profile {} is being run by another node, skipping".format(profile_name))
+            return 'skipped'
+        done = lease.completed_within(run_options['run_window'])
+        if done is not None:
+            logger.info("Profile {} was already run by {} at {}, skipping".format(
+                profile_name, done['owner'], lease.format_time(done['completed'])))
+            lease.release()
+            return 'skipped'
+    try:
+        logger.info("Profile {} start".format(profile_name))
+        try:
+            ttd_attach = run_ttd_attach(config_params, run_options, lease, file_prefix)
+        except Exception as e:
+            # a cached secret rotated in Vault is refused, the profile is run once more with a fresh fetch
+            if JiraRequestManager.status_code(e) != 401 or not run_options['cached_secret']:
+                raise
+            logger.warning("The cached Jira credential was refused, fetching it from Vault again")
+            secret = jira_credential(run_options['credential'], refresh=True)[0]
+            config_params = dict(config_params, jira_token=(config_params['jira_token'][0], secret))
+            ttd_attach = run_ttd_attach(config_params, run_options, lease, file_prefix)
+        if not run_options['watch']:
+            lease.mark_complete()
+
+        # write the per operation latency and throughput report next to the log
+        ttd_attach.metrics_report(*metrics_files(file_prefix, run_options))
+    finally:
+        lease.release()
+    return 'complete'
+
+
+# Creates the TTD-AM object and launches the process manager, optionally under cProfile for a single run dump, or in
+# watch mode keeps polling for tickets whose api stats have landed until the service is stopped, returns the TTD-AM
+#
+def run_ttd_attach(config_params, run_options, lease, file_prefix):
+    ttd_attach = TTDAttachmentManager(config_params)
+    ttd_attach.lease = lease
+    ttd_attach.metrics.record('startup.credential', run_options['secret_seconds'])
+    ttd_attach.metrics.record('startup.ready', time.time() - run_options['start_time'])
+    if run_options['watch']:
+        # the service takes the profile lease for each poll and writes its report after every poll, each covering the
+        # poll alone
+        watcher = WatchManager(ttd_attach, run_options['poll_seconds'], run_options['overlap_seconds'],
+                               report=lambda: ttd_attach.metrics_report(*metrics_files(file_prefix, run_options),
+                                                                        reset=True),
+                               lease=lease, run_window=run_options['run_window'])
+        watcher.run()
+    elif run_options['profile']:
+        profiler = cProfile.Profile()
+        profiler.runcall(ttd_attach.process_manager)
+        profiler.dump_stats('{}_{}.prof'.format(file_prefix, run_options['today_date']))
+    else:
+        ttd_attach.process_manager()
+    return ttd_attach
+
+
+# The json and Prometheus textfile names of a profile's metrics report
+#
+def metrics_files(file_prefix, run_options):
+    return '{}_{}_metrics.json'.format(file_prefix, run_options['today_date']), '{}.prom'.format(file_prefix)
+
+
+# Applies the retention policy (age, optional total size and optional gzip) to the files of a log or results
+# directory once all the profiles have finished, blank policy values switch that policy off
+#
+def purge_files(purge_dir, purge_days, max_total_mb=None, compress_days=None, pattern='*'):
+    logger = logging.getLogger(__name__)
+    try:
+        policies = [description.format(value) for description, value in
+                    (("remove files older than {} days", purge_days), ("keep the total under {} MB", max_total_mb),
+                     ("gzip files older than {} days", compress_days)) if value is not None]
+        if not policies:
+            logger.info("\n\t\tNo retention policy is set for the {} directory".format(purge_dir))
+            return
+        logger.info("\n\t\tRetention on the {} directory: {}".format(purge_dir, ', '.join(policies)))
+        RetentionManager(purge_dir, purge_days, max_total_mb, compress_days, pattern).purge()
+    except Exception as e:
+        logger.error("{}".format(e))
+
+
+def main(con_opt='n', watch=None):
+    start_time = time.time()
     today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
 
     # create a configparser object and open in read mode
     config = configparser.ConfigParser()
     config.read('config.ini')
 
-    # Vault Client Object
-    VC_Obj = VaultClient("prod")
-    pd = VC_Obj.VaultSecret('jira', str(config.get('Jira', 'authorization')))
-
-    # create a dictionary of configuration parameters
-    config_params = {
-        "jira_url":             config.get('Jira', 'url'),
-        "jira_token":           tuple([config.get('Jira', 'authorization'), pd]),
-        "jql_parent_type":      config.get('Jira', 'parent_type'),
-        "jql_parent_status":    config.get('Jira', 'parent_status'),
-        "jql_parent_text":      config.get('Jira', 'parent_text'),
-        "jql_child_status":     config.get('Jira', 'child_status'),
-        "results_json_path":    config.get('ResultsFile', 'path'),
-        "results_json_name":    config.get('Project Details', 'app_name'),
-        "email_to":             config.get('Email', 'to'),
-        "email_from":           config.get('Email', 'from')
-    }
-
     # logfile path to point to the Operations_limited drive on zfs
-    purge_days = config.get('LogFile', 'retention_days')
+    app_name = config.get('Project Details', 'app_name')
+    log_retention = retention_policy(config, 'LogFile', '*')
+    results_retention = retention_policy(config, 'ResultsFile', '{}_*-*.json*'.format(app_name))
     log_file_path = config.get('LogFile', 'path')
-    logfile_name = '{}{}_{}.log'.format(log_file_path, config.get('Project Details', 'app_name'), today_date)
+    logfile_name = '{}{}_{}.log'.format(log_file_path, app_name, today_date)
 
-    # check to see if log file already exits for the day to avoid duplicate execution
-    if not os.path.isfile(logfile_name):
-        logging.basicConfig(filename=logfile_name,
-                            level=logging.INFO,
-                            format='%(asctime)s: %(levelname)-7s: %(name)-30s: %(threadName)-12s: %(message)s',
-                            datefmt='%m/%d/%Y %H:%M:%S')
+    log_options = {
+        "buffer_path":      config.get('LogFile', 'buffer_path', fallback='').strip()
+                            or os.path.expanduser('~/.cache/{}/log_buffer/'.format(app_name)),
+        "json_lines":       config.get('LogFile', 'format', fallback='text').strip().lower() == 'json',
+        "flush_seconds":    config.getfloat('LogFile', 'flush_seconds', fallback=1.0)
+    }
 
-        logger = logging.getLogger(__name__)
+    # checks for console logger option, default value set to 'n' to not run in production
+    console = bool(con_opt and con_opt in ['y', 'Y'])
+    log_manager = start_logging(logfile_name, log_options, console)
+    logger = logging.getLogger(__name__)
+    try:
+        logger.info("Process Start - The Trade Desk Email Attachment, Data Enablement - {}\n".format(today_date))
 
-        # checks for console logger option, default value set to 'n' to not run in production
-        if con_opt and con_opt in ['y', 'Y']:
-            console_logger()
+        # Jira secret from the local credential cache, or from Vault when the cache is stale or switched off
+        credential_options = {
+            "authorization":    str(config.get('Jira', 'authorization')),
+            "cache_file":       config.get('Vault', 'cache_file', fallback='').strip()
+                                or '~/.cache/{}/jira_credential.json'.format(app_name),
+            "ttl_seconds":      int(config.get('Vault', 'ttl_seconds', fallback='').strip() or 0)
+        }
+        credential_start = time.time()
+        pd, credential_cached = jira_credential(credential_options)
+        credential_seconds = time.time() - credential_start
+        logger.info("Jira credential read from {} in {:.3f}s".format('the cache' if credential_cached else 'Vault',
+                                                                     credential_seconds))
 
-        logger.info("Process Start - The Trade Desk Email Attachment, Data Enablement - {}\n".format(today_date))
+        # create a dictionary of configuration parameters
+        config_params = {
+            "jira_url":             config.get('Jira', 'url'),
+            "jira_token":           tuple([config.get('Jira', 'authorization'), pd]),
+            "jira_max_retries":     config.getint('Jira', 'max_retries', fallback=5),
+            "pending_check":        config.getboolean('Jira', 'pending_check', fallback=True),
+            "jql_parent_type":      config.get('Jira', 'parent_type'),
+            "jql_parent_status":    config.get('Jira', 'parent_status'),
+            "jql_parent_text":      config.get('Jira', 'parent_text'),
+            "jql_child_status":     config.get('Jira', 'child_status'),
+            "results_json_path":    config.get('ResultsFile', 'path'),
+            "results_json_name":    config.get('Project Details', 'app_name'),
+            "app_name":             app_name,
+            "profile":              '',
+            "incremental":          config.getboolean('ResultsFile', 'incremental', fallback=False),
+            "history_store":        config.getboolean('ResultsFile', 'history_store', fallback=False),
+            "email_to":             config.get('Email', 'to'),
+            "email_from":           config.get('Email', 'from'),
+            "smtp_host":            config.get('Email', 'smtp_host', fallback='mailhost.valkyrie.net'),
+            "smtp_port":            config.getint('Email', 'smtp_port', fallback=25),
+            "email_batch":          config.getboolean('Email', 'batch_send', fallback=False),
+            "parallel_mode":        config.getboolean('Processing', 'parallel', fallback=False),
+            "max_workers":          config.getint('Processing', 'max_workers', fallback=4)
+        }
 
-        # create TTD-AM object and launch the process manager
-        ttd_attach = TTDAttachmentManager(config_params)
-        ttd_attach.process_manager()
+        # duplicate execution is prevented by the per profile lease files, kept in their own directory on zfs so the
+        # retention policy of the log directory never touches them
+        if watch is None:
+            watch = config.getboolean('Watch', 'enabled', fallback=False)
+        run_options = {
+            "today_date":       today_date,
+            "log_file_path":    log_file_path,
+            "logging":          log_options,
+            "console":          console,
+            "watch":            watch,
+            "poll_seconds":     config.getint('Watch', 'poll_seconds', fallback=120),
+            "overlap_seconds":  config.getint('Watch', 'overlap_seconds', fallback=120),
+            "profile":          config.getboolean('Metrics', 'profile', fallback=False),
+            "lease_path":       config.get('Lease', 'path', fallback='').strip() or '{}leases/'.format(log_file_path),
+            "lease_ttl":        config.getint('Lease', 'ttl_seconds', fallback=600),
+            "run_window":       float(config.get('Lease', 'run_window_minutes', fallback='').strip() or 0) * 60,
+            "start_time":       start_time,
+            "credential":       credential_options,
+            "cached_secret":    credential_cached,
+            "secret_seconds":   credential_seconds
+        }
+        os.makedirs(run_options['lease_path'], exist_ok=True)
+
+        # run the profiles, a single profile inline, several in worker processes (spawned, so no logging handlers or
+        # sessions are inherited from this process)
+        profiles = profile_params(config, config_params)
+        if len(profiles) == 1:
+            for profile_name, params in profiles.items():
+                outcome = run_profile(profile_name, params, run_options, inline=True)
+                logger.info("Profile {}: {}".format(profile_name, outcome))
+        else:
+            processes = int(config.get('Profiles', 'processes', fallback='').strip() or len(profiles))
+            spawn_context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=processes, mp_context=spawn_context) as executor:
+                futures = {profile_name: executor.submit(run_profile, profile_name, params, run_options)
+                           for profile_name, params in profiles.items()}
+                for profile_name, future in futures.items():
+                    try:
+                        logger.info("Profile {}: {}".format(profile_name, future.result()))
+                    except Exception as e:
+                        logger.error("Profile {} failed => {}".format(profile_name, e))
 
-        # search logfile directory for old log files to purge
-        ttd_attach.purge_files(purge_days, log_file_path)
+        # apply the retention policies to the logfile and results directories
+        purge_files(purge_dir=log_file_path, **log_retention)
+        purge_files(purge_dir=config_params['results_json_path'], **results_retention)
+        logger.info("Process End - run time {:.3f}s".format(time.time() - start_time))
+    finally:
+        # write out the queued log records and copy a spilled log buffer to zfs
+        log_manager.stop()
 
 
 if __name__ == '__main__':
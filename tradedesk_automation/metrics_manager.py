@@ -0,0 +1,150 @@
+# metrics_manager module
+# Module holds the class => MetricsManager - manages the run instrumentation
+# Class responsible for recording the latency, request count and bytes of every Jira, Email and process stage
+# operation, then writing a machine-readable json run report and a Prometheus textfile-collector file at the end of
+# the run (in watch mode after every poll, each report covering the operations since the previous one). Operations are
+# timed with the timer context manager, or by wrapping every public method of a manager instance with instrument, http
+# traffic is counted through a requests response hook.
+#
+from contextlib import contextmanager
+from functools import wraps
+import inspect
+import json
+import math
+import os
+import threading
+import time
+
+
+class MetricsManager(object):
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.run_start = time.time()
+        self.latencies = {}     # operation => list of latencies in seconds
+        self.errors = {}        # operation => error count
+        self.bytes = {}         # operation => response bytes
+        self.metrics_lock = threading.Lock()
+
+    # Records a single operation sample
+    #
+    def record(self, operation, latency, nbytes=0, error=False):
+        with self.metrics_lock:
+            self.latencies.setdefault(operation, []).append(latency)
+            self.bytes[operation] = self.bytes.get(operation, 0) + nbytes
+            if error:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    # Times the enclosed block as one sample of the operation, an exception is counted as an error and re-raised
+    #
+    @contextmanager
+    def timer(self, operation):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(operation, time.perf_counter() - start, error=True)
+            raise
+        else:
+            self.record(operation, time.perf_counter() - start)
+
+    # Replaces every public method of a manager instance with a timed wrapper named '<prefix>.<method>', generator
+    # methods are left alone as their work happens after the call returns
+    #
+    def instrument(self, manager, prefix):
+        # read from the class so properties (lazily created sessions) are not evaluated
+        for name, function in inspect.getmembers(type(manager), inspect.isfunction):
+            method = getattr(manager, name)
+            if name.startswith('_') or not inspect.ismethod(method) or inspect.isgeneratorfunction(function):
+                continue
+            setattr(manager, name, self.timed(method, '{}.{}'.format(prefix, name)))
+        return manager
+
+    # Wraps a single callable so each call is recorded as one sample of the operation
+    #
+    def timed(self, method, operation):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with self.timer(operation):
+                return method(*args, **kwargs)
+        return wrapper
+
+    # Requests response hook, counts every http request by method with its server latency and response bytes
+    #
+    def http_hook(self, response, *args, **kwargs):
+        operation = 'http.{}'.format(response.request.method)
+        content_length = response.headers.get('Content-Length')
+        nbytes = int(content_length) if content_length and content_length.isdigit() else len(response.content or b'')
+        self.record(operation, response.elapsed.total_seconds(), nbytes, error=response.status_code >= 400)
+
+    # Summarises every operation: count, errors, bytes, p50/p95/max and total latency in seconds, reset starts a new
+    # reporting period so the recorded samples do not build up in a long-running process
+    #
+    def summary(self, reset=False):
+        with self.metrics_lock:
+            operations = {}
+            for operation, samples in sorted(self.latencies.items()):
+                ordered = sorted(samples)
+                operations[operation] = {
+                    'count': len(ordered),
+                    'errors': self.errors.get(operation, 0),
+                    'bytes': self.bytes.get(operation, 0),
+                    'p50': self.percentile(ordered, 50),
+                    'p95': self.percentile(ordered, 95),
+                    'max': ordered[-1],
+                    'total': sum(ordered)
+                }
+            summary = {'app_name': self.app_name, 'run_start': self.run_start,
+                       'run_seconds': time.time() - self.run_start, 'operations': operations}
+            if reset:
+                self.run_start = time.time()
+                self.latencies, self.errors, self.bytes = {}, {}, {}
+        return summary
+
+    # Writes the json run report and the Prometheus textfile, each written to a temp file then moved into place so a
+    # collector never reads a partial file
+    #
+    def write_report(self, json_file_name, prom_file_name, reset=False):
+        summary = self.summary(reset)
+        self.atomic_write(json_file_name, json.dumps(summary, indent=4))
+
+        lines = []
+        for metric, help_text, metric_type in (
+                ('requests_total', 'Operation calls in the last run', 'gauge'),
+                ('errors_total', 'Operation errors in the last run', 'gauge'),
+                ('response_bytes', 'Response bytes in the last run', 'gauge'),
+                ('latency_seconds', 'Operation latency in the last run', 'gauge')):
+            lines.append('# HELP ttd_{} {}'.format(metric, help_text))
+            lines.append('# TYPE ttd_{} {}'.format(metric, metric_type))
+            for operation, stats in summary['operations'].items():
+                labels = 'app="{}",operation="{}"'.format(self.app_name, operation)
+                if metric == 'requests_total':
+                    lines.append('ttd_{}{{{}}} {}'.format(metric, labels, stats['count']))
+                elif metric == 'errors_total':
+                    lines.append('ttd_{}{{{}}} {}'.format(metric, labels, stats['errors']))
+                elif metric == 'response_bytes':
+                    lines.append('ttd_{}{{{}}} {}'.format(metric, labels, stats['bytes']))
+                else:
+                    for quantile in ('p50', 'p95', 'max'):
+                        lines.append('ttd_{}{{{},quantile="{}"}} {:.6f}'.format(metric, labels, quantile,
+                                                                             stats[quantile]))
+        lines.append('# HELP ttd_run_seconds Wall clock duration of the last run')
+        lines.append('# TYPE ttd_run_seconds gauge')
+        lines.append('ttd_run_seconds{{app="{}"}} {:.3f}'.format(self.app_name, summary['run_seconds']))
+        lines.append('ttd_last_run_timestamp_seconds{{app="{}"}} {:.0f}'.format(self.app_name, self.run_start))
+        self.atomic_write(prom_file_name, '\n'.join(lines) + '\n')
+
+    # Nearest rank percentile of an already sorted list
+    #
+    @staticmethod
+    def percentile(ordered, percent):
+        index = max(0, math.ceil(percent / 100.0 * len(ordered)) - 1)
+        return ordered[min(index, len(ordered) - 1)]
+
+    # Writes the text to a temp file next to the target and moves it into place
+    #
+    @staticmethod
+    def atomic_write(file_name, text):
+        temp_file_name = file_name + '.tmp'
+        with open(temp_file_name, 'w') as fp:
+            fp.write(text)
+        os.replace(temp_file_name, file_name)
@@ -0,0 +1,56 @@
+# results_file_manager module
+# Module holds the class => ResultsFileManager - manages the streamed writing of the per-run results json file
+# Class responsible for appending each ticket's api returned counts to the results file as soon as the ticket
+# completes, so a crash late in the run keeps every result written so far, and for finalising the file into the same
+# json document (same layout as json.dump with indent=4) once the run ends. The file is only created when the first
+# result arrives, and load_partial reads back a file whose run never finished (or one gzipped by the retention policy).
+#
+import gzip
+import json
+import os
+import threading
+
+
+class ResultsFileManager(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.fp = None
+        self.count = 0
+        self.file_lock = threading.Lock()
+
+    # Appends one ticket's results, flushed to disk straight away
+    #
+    def append(self, ticket_key, ticket_level_dict):
+        entry = '    {}: {}'.format(json.dumps(ticket_key),
+                                   json.dumps(ticket_level_dict, indent=4).replace('\n', '\n    '))
+        with self.file_lock:
+            if self.fp is None:
+                self.fp = open(self.file_name, 'w')
+                self.fp.write('{\n')
+            else:
+                self.fp.write(',\n')
+            self.fp.write(entry)
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            self.count += 1
+
+    # Closes the json document, returns the number of results written (0 when no file was created)
+    #
+    def finalize(self):
+        with self.file_lock:
+            if self.fp is not None:
+                self.fp.write('\n}')
+                self.fp.close()
+                self.fp = None
+            return self.count
+
+    # Reads a results file, plain or gzipped, closing the document first when the run that wrote it never finalised it
+    #
+    @staticmethod
+    def load_partial(file_name):
+        with (gzip.open(file_name, 'rt') if file_name.endswith('.gz') else open(file_name, 'r')) as fp:
+            text = fp.read().rstrip()
+        try:
+            return json.loads(text)
+        except ValueError:
+            return json.loads(text + '\n}')
@@ -0,0 +1,164 @@
+# results_store_manager module
+# Module holds the class => ResultsStoreManager - manages the indexed history of the api returned counts
+# Class responsible for the append-only sqlite results store kept in the Results directory, one store per app shared by
+# all its profiles, one row per stat per ticket per run with the profile that ran it, indexed by ticket key, parent
+# key and run date. It offers lookups and aggregates, a back-fill of the legacy per-run json files and an export to
+# the per-run json format. A ticket processed by more than one run counts once in the aggregates, with the stats of
+# its latest run. Run as a script for the command line interface,
+#   python results_store_manager.py <db_file> ticket <ticket_key>
+#   python results_store_manager.py <db_file> parent <parent_key>
+#   python results_store_manager.py <db_file> months
+#   python results_store_manager.py <db_file> import <results_dir> [<app_name>]
+#   python results_store_manager.py <db_file> export <run_id> <json_file>
+#
+from datetime import datetime
+import sqlite3
+from contextlib import closing
+import json
+import os
+import re
+import sys
+import threading
+import logging
+from results_file_manager import ResultsFileManager
+
+
+class ResultsStoreManager(object):
+    def __init__(self, db_file_name):
+        self.db_file_name = db_file_name
+        # results files gzipped by the retention policy are imported too
+        self.run_file_pattern = re.compile(r'^(.+?)_(\d{8}-\d{6})\.json(?:\.gz)?$')
+        self.store_lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "run_id TEXT NOT NULL, run_date TEXT NOT NULL, ticket_key TEXT NOT NULL, parent_key TEXT, "
+                         "stat_name TEXT NOT NULL, stat_value TEXT, profile TEXT NOT NULL DEFAULT '', "
+                         "PRIMARY KEY (run_id, ticket_key, stat_name))")
+            # stores created before the profile column get it added, their rows belong to the unnamed profile
+            if 'profile' not in [column[1] for column in conn.execute("PRAGMA table_info(results)")]:
+                conn.execute("ALTER TABLE results ADD COLUMN profile TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_ticket ON results (ticket_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_parent ON results (parent_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_run_date ON results (run_date)")
+            # finds the latest run of each ticket stat for the aggregates
+            conn.execute("CREATE INDEX IF NOT EXISTS results_latest ON results (ticket_key, stat_name, run_id)")
+
+    # Opens a connection to the store, every call uses its own short-lived connection that is closed on exit
+    #
+    def connect(self):
+        return sqlite3.connect(self.db_file_name, timeout=30)
+
+    # Appends the results of one run of a profile, results_dict is the ticket key => ticket level dict used for the
+    # per-run json, parent_keys maps a ticket key to its parent ticket key. Re-appending a run replaces the same rows.
+    #
+    def append_run(self, run_id, results_dict, parent_keys=None, profile=''):
+        parent_keys = parent_keys or {}
+        run_date = datetime.strptime(run_id, '%Y%m%d-%H%M%S').strftime('%Y-%m-%d')
+        rows = [(run_id, run_date, ticket_key, parent_keys.get(ticket_key), str(stat_name), str(stat_value), profile)
+                for ticket_key, ticket_level_dict in results_dict.items()
+                for stat_name, stat_value in ticket_level_dict.items()]
+        with self.store_lock, closing(self.connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO results (run_id, run_date, ticket_key, parent_key, stat_name, "
+                             "stat_value, profile) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    # Returns every stat recorded for a ticket as (run_id, profile, stat_name, stat_value) rows in run order
+    #
+    def ticket_history(self, ticket_key):
+        with closing(self.connect()) as conn, conn:
+            return conn.execute("SELECT run_id, profile, stat_name, stat_value FROM results WHERE ticket_key = ? "
+                                "ORDER BY run_id, stat_name", (ticket_key,)).fetchall()
+
+    # Returns every stat recorded for the children of a parent ticket as (run_id, profile, ticket_key, stat_name,
+    # stat_value) rows
+    #
+    def parent_history(self, parent_key):
+        with closing(self.connect()) as conn, conn:
+            return conn.execute("SELECT run_id, profile, ticket_key, stat_name, stat_value FROM results "
+                                "WHERE parent_key = ? ORDER BY run_id, ticket_key, stat_name", (parent_key,)).fetchall()
+
+    # Returns the numeric stat totals per month and profile as (month, profile, stat_name, total, ticket_count) rows,
+    # each ticket stat counted once with the value (and month) of its latest run
+    #
+    def monthly_totals(self):
+        with closing(self.connect()) as conn, conn:
+            return conn.execute("SELECT substr(run_date, 1, 7) AS month, profile, stat_name, "
+                                "SUM(CAST(REPLACE(stat_value, ',', '') AS INTEGER)), COUNT(DISTINCT ticket_key) "
+                                "FROM results AS r WHERE run_id = (SELECT MAX(run_id) FROM results AS l "
+                                "WHERE l.ticket_key = r.ticket_key AND l.stat_name = r.stat_name) "
+                                "GROUP BY month, profile, stat_name ORDER BY month, profile, stat_name").fetchall()
+
+    # Rebuilds the per-run json dictionary (ticket key => ticket level dict) for a single run
+    #
+    def run_results(self, run_id):
+        results_dict = {}
+        with closing(self.connect()) as conn, conn:
+            for ticket_key, stat_name, stat_value in conn.execute(
+                    "SELECT ticket_key, stat_name, stat_value FROM results WHERE run_id = ? ORDER BY rowid", (run_id,)):
+                results_dict.setdefault(ticket_key, {})[stat_name] = stat_value
+        return results_dict
+
+    # Writes a single run back out in today's per-run json format
+    #
+    def export_run(self, run_id, json_file_name):
+        results_dict = self.run_results(run_id)
+        with open(json_file_name, 'w') as fp:
+            json.dump(results_dict, fp, indent=4)
+        return len(results_dict)
+
+    # Back-fills the store from the legacy <app_name>[_<profile>]_<run_id>.json (or .json.gz) files of an app in a
+    # results directory, the parent keys of those runs were never recorded and are left empty
+    #
+    def import_json_dir(self, results_dir, app_name):
+        imported = 0
+        with os.scandir(results_dir) as entries:
+            for entry in entries:
+                match = self.run_file_pattern.match(entry.name)
+                if not entry.is_file() or match is None:
+                    continue
+                file_prefix, run_id = match.groups()
+                if file_prefix != app_name and not file_prefix.startswith(app_name + '_'):
+                    continue
+                try:
+                    # files of a run that never finished are closed before loading
+                    self.append_run(run_id, ResultsFileManager.load_partial(entry.path),
+                                    profile=file_prefix[len(app_name) + 1:])
+                except Exception as e:
+                    self.logger.warning("Could not import results file {} => {}".format(entry.path, e))
+                else:
+                    imported += 1
+        self.logger.info("{} results file(s) imported from {}".format(imported, results_dir))
+        return imported
+
+
+# Command line interface for lookups, aggregates, the back-fill import and the per-run json export
+#
+def main(argv):
+    if len(argv) < 2:
+        print("usage: results_store_manager.py <db_file> ticket|parent|months|import|export [args]")
+        return 1
+    store = ResultsStoreManager(argv[0])
+    command, args = argv[1], argv[2:]
+    if command == 'ticket' and len(args) == 1:
+        rows = store.ticket_history(args[0])
+    elif command == 'parent' and len(args) == 1:
+        rows = store.parent_history(args[0])
+    elif command == 'months' and not args:
+        rows = store.monthly_totals()
+    elif command == 'import' and len(args) in (1, 2):
+        # the app name defaults to the one the store is named after, <app_name>_results.db
+        app_name = args[1] if len(args) == 2 else os.path.basename(argv[0]).rsplit('_results.db', 1)[0]
+        rows = [(store.import_json_dir(args[0], app_name), 'file(s) imported')]
+    elif command == 'export' and len(args) == 2:
+        rows = [(store.export_run(args[0], args[1]), 'ticket(s) exported')]
+    else:
+        print("unknown command or arguments: {}".format(' '.join(argv[1:])))
+        return 1
+    for row in rows:
+        print('\t'.join(str(value) for value in row))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+# retention_manager module
+# Module holds the class => RetentionManager - manages the retention of the log and results files on zfs
+# Class responsible for applying an age policy, an optional total size policy and optional gzip compression to the
+# files of a single directory. The directory is read once with os.scandir and each entry's cached stat result is used
+# for every decision, so the NFS share sees one stat per file, and a single summary line is logged per directory.
+#
+from fnmatch import fnmatch
+import gzip
+import shutil
+import time
+import os
+import logging
+
+
+class RetentionManager(object):
+    def __init__(self, purge_dir, retention_days=None, max_total_mb=None, compress_days=None, pattern='*'):
+        self.purge_dir = purge_dir
+        self.retention_days = retention_days
+        self.max_total_mb = max_total_mb
+        self.compress_days = compress_days
+        self.pattern = pattern
+        self.logger = logging.getLogger(__name__)
+
+    # Applies the compression, age and size policies in that order and logs a summary, returns the summary counts
+    #
+    def purge(self):
+        now = time.time()
+        summary = {'compressed': 0, 'aged': 0, 'sized': 0, 'freed': 0, 'errors': 0}
+
+        # one scandir pass, (path, mtime, size) for every matching file, oldest first
+        files = []
+        with os.scandir(self.purge_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and self.matches(entry.name):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((entry.path, stat.st_mtime, stat.st_size))
+        files.sort(key=lambda file_info: file_info[1])
+
+        kept = []
+        for path, mtime, size in files:
+            age_days = (now - mtime) / 86400
+            if self.retention_days is not None and age_days > self.retention_days:
+                if self.remove(path, summary):
+                    summary['aged'] += 1
+                    summary['freed'] += size
+                    continue
+            elif self.compress_days is not None and age_days > self.compress_days and not path.endswith('.gz'):
+                compressed = self.compress(path, mtime, summary)
+                if compressed is not None:
+                    summary['compressed'] += 1
+                    summary['freed'] += size - compressed[1]
+                    path, size = compressed
+            kept.append((path, size))
+
+        total_size = sum(size for path, size in kept)
+        if self.max_total_mb is not None:
+            max_total_bytes = self.max_total_mb * 1024 * 1024
+            for path, size in kept[:]:
+                if total_size <= max_total_bytes:
+                    break
+                if self.remove(path, summary):
+                    summary['sized'] += 1
+                    summary['freed'] += size
+                    total_size -= size
+                    kept.remove((path, size))
+
+        self.logger.info("Retention on {}: {} compressed, {} removed by age, {} removed by size, {} bytes freed, "
+                         "{} file(s) and {} bytes remain, {} error(s)"
+                         .format(self.purge_dir, summary['compressed'], summary['aged'], summary['sized'],
+                                 summary['freed'], len(kept), total_size, summary['errors']))
+        return summary
+
+    # True when the file name matches one of the comma separated glob patterns
+    #
+    def matches(self, name):
+        return any(fnmatch(name, pattern.strip()) for pattern in self.pattern.split(','))
+
+    # Removes a file, counting rather than raising a failure so the rest of the batch still runs
+    #
+    def remove(self, path, summary):
+        try:
+            os.remove(path)
+        except OSError as e:
+            summary['errors'] += 1
+            self.logger.warning("Could not remove file [{}] => {}".format(path, e))
+            return False
+        return True
+
+    # Gzips a file next to itself keeping its modification time, so the age policy still applies to the .gz copy,
+    # then removes the original, returns the new path and size or None on failure
+    #
+    def compress(self, path, mtime, summary):
+        gz_path = path + '.gz'
+        try:
+            with open(path, 'rb') as f_in, gzip.open(gz_path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.utime(gz_path, (mtime, mtime))
+            gz_size = os.stat(gz_path).st_size
+            os.remove(path)
+        except OSError as e:
+            summary['errors'] += 1
+            self.logger.warning("Could not compress file [{}] => {}".format(path, e))
+            return None
+        return gz_path, gz_size
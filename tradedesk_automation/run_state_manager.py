@@ -0,0 +1,141 @@
+# run_state_manager module
+# Module holds the class => RunStateManager - manages the persisted state between runs
+# Class responsible for the local state file kept next to the results json, it records the watermark of the last
+# successful run and the key, 'updated' timestamp and outcome of every child ticket handled, so repeat runs only
+# search for changed tickets and do not re-alert tickets that already carry the "no api results" comment. Jira reads
+# jql date literals in the timezone of the Jira user, so the watermark is kept in UTC and searched as a relative
+# 'updated >= "-Nm"' clause, which Jira measures back from its own clock
+#
+from datetime import datetime, timedelta, timezone
+import math
+import json
+import os
+import threading
+import logging
+
+
+class RunStateManager(object):
+    def __init__(self, state_file_name):
+        self.state_file_name = state_file_name
+        self.run_start = datetime.now(timezone.utc)
+        self.watermark = None
+        self.tickets = {}
+        self.run_failures = set()                   # keys of the tickets that failed in this run
+        self.state_lock = threading.Lock()
+        self.margin_minutes = 1                     # covers the rounding up to whole minutes and any in-flight update
+        self.state_date_format = '%Y-%m-%dT%H:%M:%S%z'
+        self.jira_date_format = '%Y-%m-%dT%H:%M:%S.%f%z'
+        self.logger = logging.getLogger(__name__)
+
+    # Reads the state file left by the previous successful run, a missing or unreadable file means a full run
+    #
+    def load(self):
+        try:
+            with open(self.state_file_name, 'r') as fp:
+                state = json.load(fp)
+        except FileNotFoundError:
+            self.logger.info("No run state found at {}, all tickets will be searched.".format(self.state_file_name))
+        except Exception as e:
+            self.logger.warning("The run state file could not be read, all tickets will be searched => {}".format(e))
+        else:
+            self.tickets = state.get('tickets', {})
+            if state.get('last_run'):
+                self.watermark = self.parse_watermark(state['last_run'])
+            self.logger.info("Run state loaded, watermark is {}".format(self.watermark))
+
+    # A watermark saved before it carried a timezone was written in the host's local time
+    #
+    def parse_watermark(self, last_run):
+        try:
+            return datetime.strptime(last_run, self.state_date_format)
+        except ValueError:
+            return datetime.strptime(last_run, '%Y-%m-%dT%H:%M:%S').astimezone()
+
+    # A Jira 'updated' timestamp as an aware datetime, None when it cannot be read
+    #
+    def jira_time(self, updated):
+        try:
+            return datetime.strptime(updated, self.jira_date_format)
+        except (ValueError, TypeError):
+            return None
+
+    # The oldest 'updated' time a search for tickets updated since the given time can return, it reaches back the
+    # margin and up to a minute of rounding
+    #
+    def reach(self, since):
+        return since - timedelta(minutes=self.margin_minutes + 1)
+
+    # Returns the jql clause limiting a search to tickets updated since the watermark, empty on a full run
+    #
+    def jql_clause(self):
+        if self.watermark is None:
+            return ""
+        return self.updated_since(self.watermark)
+
+    # Returns the jql clause for tickets updated since an aware time, as the whole minutes elapsed since then (plus the
+    # margin) so the search does not depend on the timezone of the Jira user or of this host
+    #
+    def updated_since(self, since):
+        elapsed = (datetime.now(timezone.utc) - since).total_seconds()
+        return ' AND updated >= "-{}m"'.format(max(0, math.ceil(elapsed / 60)) + self.margin_minutes)
+
+    # Drops the entries of tickets last updated before the reach of the searches still to come, such a ticket is only
+    # searched again once it changes, and then its entry no longer matches anyway
+    #
+    def prune(self, reach):
+        with self.state_lock:
+            self.prune_entries(reach)
+
+    # prune with the state lock already held, an entry without a readable timestamp is dropped too
+    #
+    def prune_entries(self, reach):
+        kept = {}
+        for ticket_key, entry in self.tickets.items():
+            updated = self.jira_time(entry.get('updated'))
+            if updated is not None and updated >= reach:
+                kept[ticket_key] = entry
+        self.tickets = kept
+        self.run_failures &= set(kept)
+
+    # True when the ticket was alerted with the no results comment and has not changed since
+    #
+    def should_skip(self, ticket):
+        with self.state_lock:
+            entry = self.tickets.get(ticket.key)
+        return entry is not None and entry['outcome'] == 'no_results' \
+            and entry['updated'] == str(ticket.fields.updated)
+
+    # Records the outcome of a ticket and its 'updated' timestamp after the automation's own writes
+    #
+    def record(self, ticket, outcome, updated=None):
+        with self.state_lock:
+            self.tickets[ticket.key] = {'updated': str(updated or ticket.fields.updated), 'outcome': outcome}
+            if outcome == 'failed':
+                self.run_failures.add(ticket.key)
+            else:
+                self.run_failures.discard(ticket.key)
+
+    # Writes the state for the next run, the new watermark is this run's start time, pulled back to the oldest ticket
+    # that failed in this run so it is searched for again. A failure from an earlier run that was not searched again
+    # has left the child status (or was handled by hand) and no longer holds the watermark back. Entries the next
+    # search can no longer reach are dropped, an unchanged ticket is not searched so it needs no entry.
+    #
+    def save(self):
+        watermark = self.run_start
+        with self.state_lock:
+            for ticket_key in self.run_failures:
+                updated = self.jira_time(self.tickets[ticket_key].get('updated'))
+                if updated is not None:
+                    watermark = min(watermark, updated)
+            self.prune_entries(self.reach(watermark))
+            state = {'last_run': watermark.astimezone(timezone.utc).strftime(self.state_date_format),
+                     'tickets': self.tickets}
+        try:
+            temp_file_name = self.state_file_name + '.tmp'
+            with open(temp_file_name, 'w') as fp:
+                json.dump(state, fp, indent=4)
+            os.replace(temp_file_name, self.state_file_name)
+        except Exception as e:
+            self.logger.error("There was a problem saving the run state to {} => {}".format(self.state_file_name, e))
+        else:
+            self.logger.info("The run state has been saved to: {}".format(self.state_file_name))
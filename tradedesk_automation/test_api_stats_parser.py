@@ -0,0 +1,42 @@
+# test_api_stats_parser module
+# Behaviour tests for APIStatsParser => run with python -m pytest (or python -m unittest) from this directory
+#
+import unittest
+
+from api_stats_parser import APIStatsParser
+
+
+class APIStatsParserTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = APIStatsParser()
+
+    def test_parses_stat_lines_after_header(self):
+        body = 'TradeDesk API stats:\nImpressions: 1,234\nClicks: 56\n'
+        self.assertEqual(self.parser.parse(body), {'Impressions': '1,234', 'Clicks': '56'})
+
+    def test_tolerates_whitespace_and_crlf(self):
+        body = '  TradeDesk API stats:  \r\n\r\n   Impressions :   1,234  \r\n\tClicks:56\r\n'
+        self.assertEqual(self.parser.parse(body), {'Impressions': '1,234', 'Clicks': '56'})
+
+    def test_header_without_stats_is_not_a_match(self):
+        self.assertIsNone(self.parser.parse('TradeDesk API stats:'))
+        self.assertIsNone(self.parser.parse('TradeDesk API stats:\n\n'))
+        self.assertIsNone(self.parser.parse('TradeDesk API stats:\nstats to follow tomorrow'))
+
+    def test_stops_at_first_line_that_is_not_a_stat(self):
+        body = 'TradeDesk API stats:\nImpressions: 10\n\nThanks, see you: next week'
+        self.assertEqual(self.parser.parse(body), {'Impressions': '10'})
+
+    def test_header_must_start_the_comment(self):
+        self.assertIsNone(self.parser.parse('Re: TradeDesk API stats:\nImpressions: 10'))
+        self.assertIsNone(self.parser.parse(None))
+
+    def test_search_returns_first_matching_comment(self):
+        comments = [{'body': 'no stats here'}, {'body': 'TradeDesk API stats:'},
+                    {'body': 'TradeDesk API stats:\nClicks: 5'}, {'body': 'TradeDesk API stats:\nClicks: 9'}]
+        self.assertEqual(self.parser.search(comments), ('TradeDesk API stats:\nClicks: 5', {'Clicks': '5'}))
+        self.assertEqual(self.parser.search([{'body': 'nothing'}]), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# test_lease_manager module
+# Behaviour tests for LeaseManager => run with python -m pytest (or python -m unittest) from this directory
+#
+import tempfile
+import unittest
+import json
+import time
+import os
+
+from lease_manager import LeaseManager
+
+
+class LeaseManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.lease_dir = self.temp_dir.name
+        self.leases = []
+
+    def tearDown(self):
+        for lease in self.leases:
+            lease.release()
+        self.temp_dir.cleanup()
+
+    def lease(self, owner, ttl_seconds=60):
+        lease = LeaseManager(self.lease_dir, 'profile', ttl_seconds, owner=owner)
+        self.leases.append(lease)
+        return lease
+
+    def test_one_owner_at_a_time(self):
+        first, second = self.lease('node-a:1'), self.lease('node-b:2')
+        self.assertTrue(first.acquire())
+        self.assertTrue(first.held())
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertFalse(first.held())
+        self.assertTrue(second.acquire())
+
+    def test_lease_can_be_taken_again_after_release(self):
+        lease = self.lease('node-a:1')
+        for _ in range(2):
+            self.assertTrue(lease.acquire())
+            self.assertTrue(lease.held())
+            lease.release()
+        self.assertFalse(os.path.exists(lease.lease_file_name))
+
+    def test_expired_lease_is_taken_over(self):
+        with open(os.path.join(self.lease_dir, 'profile.lease'), 'w') as fp:
+            json.dump({'owner': 'dead-node:1', 'expires': time.time() - 1}, fp)
+        lease = self.lease('node-a:1')
+        self.assertTrue(lease.acquire())
+        self.assertEqual(lease.read()['owner'], 'node-a:1')
+
+    def test_release_leaves_another_owners_lease(self):
+        first, second = self.lease('node-a:1'), self.lease('node-b:2')
+        self.assertTrue(second.acquire())
+        first.release()
+        self.assertEqual(first.read()['owner'], 'node-b:2')
+
+    def test_completion_marker_within_window(self):
+        lease = self.lease('node-a:1')
+        self.assertIsNone(lease.completed_within(3600))
+        lease.mark_complete()
+        done = self.lease('node-b:2').completed_within(3600)
+        self.assertEqual(done['owner'], 'node-a:1')
+        self.assertIsNone(lease.completed_within(0))
+        self.assertIsNone(lease.completed_within(None))
+
+    def test_completion_marker_outside_window(self):
+        with open(os.path.join(self.lease_dir, 'profile.done'), 'w') as fp:
+            json.dump({'owner': 'node-a:1', 'completed': time.time() - 7200}, fp)
+        self.assertIsNone(self.lease('node-b:2').completed_within(3600))
+
+
+if __name__ == '__main__':
+    unittest.main()
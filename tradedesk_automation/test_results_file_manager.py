@@ -0,0 +1,53 @@
+# test_results_file_manager module
+# Behaviour tests for ResultsFileManager => run with python -m pytest (or python -m unittest) from this directory
+#
+import tempfile
+import unittest
+import gzip
+import json
+import os
+
+from results_file_manager import ResultsFileManager
+
+
+class ResultsFileManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.temp_dir.name, 'results.json')
+        self.results = {'CAM-1': {'Impressions': '1,234'}, 'CAM-2': {'Clicks': '5', 'Impressions': '6'}}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_results(self):
+        results_file = ResultsFileManager(self.file_name)
+        for ticket_key, ticket_level_dict in self.results.items():
+            results_file.append(ticket_key, ticket_level_dict)
+        return results_file
+
+    def test_finalized_file_matches_json_dump(self):
+        self.assertEqual(self.write_results().finalize(), 2)
+        with open(self.file_name, 'r') as fp:
+            self.assertEqual(fp.read(), json.dumps(self.results, indent=4))
+
+    def test_no_results_creates_no_file(self):
+        self.assertEqual(ResultsFileManager(self.file_name).finalize(), 0)
+        self.assertFalse(os.path.exists(self.file_name))
+
+    def test_load_partial_reads_an_unfinished_run(self):
+        results_file = self.write_results()
+        try:
+            self.assertEqual(ResultsFileManager.load_partial(self.file_name), self.results)
+        finally:
+            results_file.finalize()
+        self.assertEqual(ResultsFileManager.load_partial(self.file_name), self.results)
+
+    def test_load_partial_reads_a_gzipped_file(self):
+        self.write_results().finalize()
+        with open(self.file_name, 'rb') as f_in, gzip.open(self.file_name + '.gz', 'wb') as f_out:
+            f_out.write(f_in.read())
+        self.assertEqual(ResultsFileManager.load_partial(self.file_name + '.gz'), self.results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# test_retention_manager module
+# Behaviour tests for RetentionManager => run with python -m pytest (or python -m unittest) from this directory
+#
+import tempfile
+import unittest
+import gzip
+import time
+import os
+
+from retention_manager import RetentionManager
+
+
+class RetentionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.purge_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def make_file(self, name, age_days, size=100):
+        path = os.path.join(self.purge_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(b'x' * size)
+        mtime = time.time() - age_days * 86400
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_no_policy_keeps_everything(self):
+        self.make_file('old.log', 400)
+        summary = RetentionManager(self.purge_dir).purge()
+        self.assertEqual(summary, {'compressed': 0, 'aged': 0, 'sized': 0, 'freed': 0, 'errors': 0})
+        self.assertEqual(os.listdir(self.purge_dir), ['old.log'])
+
+    def test_age_policy_removes_only_older_files(self):
+        self.make_file('old.log', 10)
+        self.make_file('new.log', 1)
+        summary = RetentionManager(self.purge_dir, retention_days=7).purge()
+        self.assertEqual(summary['aged'], 1)
+        self.assertEqual(os.listdir(self.purge_dir), ['new.log'])
+
+    def test_size_policy_removes_oldest_first(self):
+        for name, age_days in (('a.log', 3), ('b.log', 2), ('c.log', 1)):
+            self.make_file(name, age_days, size=600 * 1024)
+        summary = RetentionManager(self.purge_dir, max_total_mb=1).purge()
+        self.assertEqual(summary['sized'], 2)
+        self.assertEqual(os.listdir(self.purge_dir), ['c.log'])
+
+    def test_compression_keeps_content_and_mtime(self):
+        path = self.make_file('results.json', 5)
+        mtime = os.stat(path).st_mtime
+        summary = RetentionManager(self.purge_dir, retention_days=30, compress_days=2).purge()
+        self.assertEqual(summary['compressed'], 1)
+        self.assertEqual(os.listdir(self.purge_dir), ['results.json.gz'])
+        self.assertAlmostEqual(os.stat(path + '.gz').st_mtime, mtime, places=2)
+        with gzip.open(path + '.gz', 'rb') as fp:
+            self.assertEqual(fp.read(), b'x' * 100)
+
+    def test_pattern_limits_the_files_considered(self):
+        self.make_file('old.log', 10)
+        self.make_file('old.txt', 10)
+        RetentionManager(self.purge_dir, retention_days=7, pattern='*.log, *.json').purge()
+        self.assertEqual(os.listdir(self.purge_dir), ['old.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# test_run_state_manager module
+# Behaviour tests for RunStateManager => run with python -m pytest (or python -m unittest) from this directory
+#
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import tempfile
+import unittest
+import json
+import os
+
+from run_state_manager import RunStateManager
+
+
+def jira_time(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.000%z')
+
+
+def ticket(key, updated):
+    return SimpleNamespace(key=key, fields=SimpleNamespace(updated=updated))
+
+
+class RunStateManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.state_file_name = os.path.join(self.temp_dir.name, 'state.json')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def saved_state(self):
+        with open(self.state_file_name, 'r') as fp:
+            return json.load(fp)
+
+    def test_first_run_searches_everything(self):
+        run_state = RunStateManager(self.state_file_name)
+        run_state.load()
+        self.assertEqual(run_state.jql_clause(), '')
+
+    def test_watermark_is_searched_as_relative_minutes(self):
+        run_state = RunStateManager(self.state_file_name)
+        # 29.5 minutes elapsed round up to 30, plus the one minute margin
+        run_state.watermark = datetime.now(timezone.utc) - timedelta(minutes=29, seconds=30)
+        self.assertEqual(run_state.jql_clause(), ' AND updated >= "-31m"')
+
+    def test_save_and_load_round_trip(self):
+        run_state = RunStateManager(self.state_file_name)
+        run_state.record(ticket('CAM-1', jira_time(datetime.now(timezone.utc))), 'no_results')
+        run_state.save()
+
+        loaded = RunStateManager(self.state_file_name)
+        loaded.load()
+        self.assertEqual(loaded.watermark, run_state.run_start.replace(microsecond=0))
+        self.assertTrue(loaded.should_skip(ticket('CAM-1', loaded.tickets['CAM-1']['updated'])))
+        self.assertFalse(loaded.should_skip(ticket('CAM-1', jira_time(datetime.now(timezone.utc) + timedelta(1)))))
+
+    def test_failure_in_this_run_pulls_the_watermark_back(self):
+        failed_at = datetime.now(timezone.utc) - timedelta(hours=2)
+        run_state = RunStateManager(self.state_file_name)
+        run_state.record(ticket('CAM-1', jira_time(failed_at)), 'failed')
+        run_state.save()
+        self.assertEqual(self.saved_state()['last_run'], failed_at.strftime('%Y-%m-%dT%H:%M:%S+0000'))
+        self.assertIn('CAM-1', self.saved_state()['tickets'])
+
+    def test_old_failure_does_not_pin_the_watermark(self):
+        old = jira_time(datetime.now(timezone.utc) - timedelta(days=30))
+        with open(self.state_file_name, 'w') as fp:
+            json.dump({'last_run': '2020-01-01T00:00:00+0000',
+                       'tickets': {'CAM-OLD': {'updated': old, 'outcome': 'failed'}}}, fp)
+        run_state = RunStateManager(self.state_file_name)
+        run_state.load()
+        run_state.save()
+        self.assertEqual(self.saved_state()['last_run'], run_state.run_start.strftime('%Y-%m-%dT%H:%M:%S+0000'))
+        self.assertEqual(self.saved_state()['tickets'], {})
+
+    def test_prune_drops_entries_out_of_reach(self):
+        now = datetime.now(timezone.utc)
+        run_state = RunStateManager(self.state_file_name)
+        run_state.record(ticket('CAM-OLD', jira_time(now - timedelta(hours=1))), 'failed')
+        run_state.record(ticket('CAM-NEW', jira_time(now)), 'no_results')
+        run_state.tickets['CAM-BAD'] = {'updated': 'not a time', 'outcome': 'no_results'}
+        run_state.prune(run_state.reach(now - timedelta(minutes=5)))
+        self.assertEqual(list(run_state.tickets), ['CAM-NEW'])
+        self.assertEqual(run_state.run_failures, set())
+
+    def test_legacy_naive_watermark_is_local_time(self):
+        with open(self.state_file_name, 'w') as fp:
+            json.dump({'last_run': '2024-03-01T12:00:00', 'tickets': {}}, fp)
+        run_state = RunStateManager(self.state_file_name)
+        run_state.load()
+        self.assertEqual(run_state.watermark, datetime(2024, 3, 1, 12, 0, 0).astimezone())
+
+
+if __name__ == '__main__':
+    unittest.main()
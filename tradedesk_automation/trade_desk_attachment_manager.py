@@ -3,13 +3,18 @@
 # Class responsible for overall program management
 #
 from datetime import datetime, timedelta
-import time
-import os
-from io import StringIO
-import json
+from io import BytesIO
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from jira_manager import JiraManager
 from email_manager import EmailManager
+from api_stats_parser import APIStatsParser
+from run_state_manager import RunStateManager
+from results_store_manager import ResultsStoreManager
+from metrics_manager import MetricsManager
+from results_file_manager import ResultsFileManager
+from log_manager import LogManager
 
 today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
 
@@ -18,88 +23,269 @@ class TTDAttachmentManager(object):
     def __init__(self, config_params):
         self.jira_url = config_params['jira_url']
         self.jira_token = config_params['jira_token']
-        self.jira_pars = JiraManager(self.jira_url, self.jira_token)
-        self.parent_jql_kwargs = {'parent_ticket': None,
-                                  'ticket_type': config_params['jql_parent_type'],
+        self.jira_pars = JiraManager(self.jira_url, self.jira_token, config_params['jira_max_retries'])
+        self.parent_jql_kwargs = {'ticket_type': config_params['jql_parent_type'],
                                   'ticket_status': config_params['jql_parent_status'],
                                   'summary_text': config_params['jql_parent_text']}
         self.jql_child_status = config_params['jql_child_status']
+        # a count-only search for pending child tickets comes first, so a run with nothing to do stops after it
+        self.pending_check = config_params['pending_check']
         self.results_json_path = config_params['results_json_path']
         self.results_json_name = config_params['results_json_name']
         self.email_to = config_params['email_to']
         self.email_from = config_params['email_from']
-        self.results_file_name = '{}{}_{}.json'.format(self.results_json_path, self.results_json_name, today_date)
+        self.email_batch = config_params['email_batch']
+        # batch mode: (ticket, email subject, message, attachment, results) of each queued email, the ticket is
+        # completed and its results written once the email is sent
+        self.queued_tickets = []
+        self.email_pars = EmailManager(self.email_to, self.email_from,
+                                       config_params['smtp_host'], config_params['smtp_port'])
+        self.run_id = today_date
+        self.results_file_name = '{}{}_{}.json'.format(self.results_json_path, self.results_json_name, self.run_id)
+        # each ticket's results are streamed to the results file (and history store) as soon as the ticket completes
+        self.results_file = ResultsFileManager(self.results_file_name)
         self.parent_tickets = []
-        self.child_tickets = []
-        self.results_dict = {}
+        self.history_store = config_params['history_store']
+        # one history store per app, shared by its profiles, each row carries the profile it was written by
+        self.history_file_name = '{}{}_results.db'.format(self.results_json_path, config_params['app_name'])
+        self.profile = config_params['profile']
+        self.results_store = None
+        self.stats_parser = APIStatsParser()
+        self.results_lock = threading.Lock()
+        self.parallel_mode = config_params['parallel_mode']
+        self.max_workers = config_params['max_workers']
+        self.incremental = config_params['incremental']
+        # the batch run alerts tickets without api results, watch mode leaves them for the batch run
+        self.alert_missing = True
+        # the profile's lease (LeaseManager) when run from main, no ticket is touched once the lease is lost
+        self.lease = None
+        self.run_state = RunStateManager('{}{}_state.json'.format(self.results_json_path, self.results_json_name))
+        # time every Jira and Email call, every http request and each per ticket stage of the process
+        self.metrics = MetricsManager(self.results_json_name)
+        self.metrics.instrument(self.jira_pars, 'jira')
+        self.metrics.instrument(self.email_pars, 'email')
+        self.jira_pars.response_hooks.append(self.metrics.http_hook)
+        for stage in ('child_ticket_processor', 'comments_searcher', 'emailer', 'ticket_manager'):
+            setattr(self, stage, self.metrics.timed(getattr(self, stage), 'stage.{}'.format(stage)))
         self.logger = logging.getLogger(__name__)
 
     # Manages the overall automation
     #
     def process_manager(self):
+        # incremental runs only search for the child tickets updated since the last successful run
+        child_clause = ""
+        if self.incremental:
+            self.run_state.load()
+            child_clause = self.run_state.jql_clause()
+
+        # a run with no pending child tickets stops after one count-only search, before the jira client is even built,
+        # the queued emails are sent and their tickets completed even when a later ticket stops the run
+        try:
+            if self.pending_check and not self.child_tickets_pending(child_clause):
+                self.logger.info("There are no pending child tickets, nothing to do.")
+            else:
+                self.process_parent_tickets(child_clause)
+        finally:
+            self.finish_run()
+        if self.incremental:
+            self.run_state.save()
+
+    # Searches the parent tickets and streams their child ticket(s) page by page through the per ticket pipeline
+    #
+    def process_parent_tickets(self, child_clause):
         # pulls desired tickets running jql
-        self.parent_tickets = self.jira_pars.find_tickets('parent', **self.parent_jql_kwargs)
+        with self.metrics.timer('stage.parent_search'):
+            self.parent_tickets = self.jira_pars.find_tickets(**self.parent_jql_kwargs) or []
         self.logger.info("{} ticket(s) were found.".format(len(self.parent_tickets)))
         self.logger.info(str([ticket.key for ticket in self.parent_tickets]) + "\n")
 
-        # verifies that parent tickets were found that match the search criteria and logs parent ticket key,
-        # then finds child ticket(s) and pulls issue information for email propagation
+        # verifies that parent tickets were found that match the search criteria, then finds all the related active
+        # child tickets in batched searches
         if self.parent_tickets:
+            child_tickets = self.jira_pars.iter_child_tickets(self.parent_tickets, self.jql_child_status, child_clause)
+            parents_with_children = set()
+            self.process_child_tickets(self.log_parents(child_tickets, parents_with_children))
+
             for parent_ticket in self.parent_tickets:
-                self.logger.info("Parent Ticket Number: {}".format(parent_ticket))
-
-                # find the related active child ticket
-                child_jql_kwargs = {'parent_ticket': parent_ticket, 'ticket_type': None,
-                                    'ticket_status': self.jql_child_status, 'summary_text': None}
-                child_tickets = self.jira_pars.find_tickets('child', **child_jql_kwargs)
-
-                if child_tickets is not None:
-                    # only one ticket in list, so eliminate the list data structure by removing the only ticket
-                    #child_ticket = child_tickets.pop()
-                    # small rewrite to allow for multiple child tickets per parent ticket in a single week
-                    self.logger.info("Child Tickets: {}".format(str([ticket.key for ticket in self.child_tickets])
-                                                                + "\n"))
-                    for child_ticket in child_tickets:
-                        self.logger.info("Child Ticket: {}".format(child_ticket.key))
-                        # mine the child ticket for information
-                        comments, title = self.jira_pars.information_pull(child_ticket)
-                        # create the subject line for email population
-                        email_subject = "{} {}".format(child_ticket.key, title)
-                        # search comments for only the api returned counts
-                        if comments is not None:
-                            results_text, ticket_level_dict = self.comments_searcher(comments)
-                            if results_text is not None:
-                                # send results at email and attach text copy to ticket
-                                attachment = self.emailer(child_ticket, email_subject, results_text)
-                                self.ticket_manager(child_ticket, email_subject, attachment)
-                                # save ticket level results dict into a run dict
-                                self.results_dict[child_ticket.key] = ticket_level_dict
-                            else:
-                                self.ticket_manager(child_ticket, email_subject, None)
+                if parent_ticket.key not in parents_with_children:
+                    self.logger.warning("There are no child tickets for Parent Ticket Number: {}".format(parent_ticket))
+
+    # Counts the child tickets waiting in the child status (and changed since the last run when incremental), returns
+    # True when there is anything to process
+    #
+    def child_tickets_pending(self, child_clause):
+        with self.metrics.timer('stage.pending_check'):
+            pending = self.jira_pars.count_pending(self.jql_child_status, child_clause)
+        self.logger.info("{} child ticket(s) pending.".format(pending))
+        return pending > 0
+
+    # Passes the streamed child tickets through, logging each parent ticket the first time one of its children appears
+    #
+    def log_parents(self, child_tickets, parents_with_children):
+        for child_ticket in child_tickets:
+            parent_key = child_ticket.fields.parent.key
+            if parent_key not in parents_with_children:
+                parents_with_children.add(parent_key)
+                self.logger.info("Parent Ticket Number: {}".format(parent_key))
+            yield child_ticket
+
+    # Polls for child tickets updated since the given (timezone aware) time and runs the pipeline on those not already
+    # handled at the same 'updated' timestamp, used by watch mode, returns ticket key => ('updated' timestamp, outcome)
+    #
+    def process_updates(self, since, handled):
+        child_clause = self.run_state.updated_since(since)
+        if self.pending_check and not self.child_tickets_pending(child_clause):
+            return {}
+        with self.metrics.timer('stage.parent_search'):
+            parent_tickets = self.jira_pars.find_tickets(**self.parent_jql_kwargs) or []
+        updated = {}
+
+        # only the tickets not already handled at their current 'updated' timestamp go through the pipeline
+        def unhandled(child_tickets):
+            for child_ticket in child_tickets:
+                if handled.get(child_ticket.key) != str(child_ticket.fields.updated):
+                    updated[child_ticket.key] = str(child_ticket.fields.updated)
+                    yield child_ticket
+
+        outcomes = self.process_child_tickets(unhandled(
+            self.jira_pars.iter_child_tickets(parent_tickets, self.jql_child_status, child_clause)))
+        return {ticket_key: (updated[ticket_key], outcome) for ticket_key, outcome in outcomes.items()}
+
+    # Runs the pipeline over a stream of child tickets, on the worker pool in parallel mode, returns the outcome of
+    # each ticket keyed by ticket key
+    #
+    def process_child_tickets(self, child_tickets):
+        if self.parallel_mode:
+            with self.metrics.timer('stage.parallel_child_processor'):
+                return self.parallel_child_processor(child_tickets)
+        return {child_ticket.key: self.child_ticket_processor(child_ticket) for child_ticket in child_tickets}
+
+    # Sends any queued emails and completes their tickets, closes the smtp session and finalises the results file
+    # streamed since the last call, a new run id is taken so the next call (in watch mode) writes its own results file,
+    # returns the outcome of each ticket whose email was queued keyed by ticket key
+    #
+    def finish_run(self):
+        outcomes = {}
+        if self.email_batch:
+            with self.metrics.timer('stage.send_queued_emails'):
+                outcomes = self.send_queued_emails()
+        self.email_pars.close()
+        self.json_file_write()
+        with self.results_lock:
+            self.run_id = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d-%H%M%S')
+            self.results_file_name = '{}{}_{}.json'.format(self.results_json_path, self.results_json_name,
+                                                           self.run_id)
+            self.results_file = ResultsFileManager(self.results_file_name)
+        return outcomes
+
+    # Runs the full pipeline for a single child ticket: information pull, comment search, email and ticket update,
+    # returns the ticket outcome ('complete', 'no_results', 'pending', 'queued', 'failed' or 'skipped')
+    #
+    def child_ticket_processor(self, child_ticket):
+        # every record logged while the ticket is processed carries its ticket and parent keys (JSON lines log)
+        LogManager.set_ticket(child_ticket.key, child_ticket.fields.parent.key)
+        try:
+            return self.ticket_pipeline(child_ticket)
+        finally:
+            # the ticket is done with, release its cached issue so memory stays bounded by the search page
+            self.jira_pars.invalidate_issue(child_ticket)
+            LogManager.set_ticket(None)
+
+    def ticket_pipeline(self, child_ticket):
+        if self.lease is not None and not self.lease.held():
+            # counted as failed so neither the run state watermark nor watch mode treat the ticket as handled
+            self.logger.warning("Lease lost, ticket {} is left for the node holding it.".format(child_ticket.key))
+            self.run_state.record(child_ticket, 'failed')
+            return 'failed'
+        self.logger.info("Child Ticket: {}".format(child_ticket.key))
+        if self.incremental and self.run_state.should_skip(child_ticket):
+            self.logger.info("Ticket {} is unchanged since its no results alert, skipping.".format(child_ticket.key))
+            return 'skipped'
+        # mine the child ticket for information
+        comments, title = self.jira_pars.information_pull(child_ticket)
+        # create the subject line for email population
+        email_subject = "{} {}".format(child_ticket.key, title)
+        # search comments for only the api returned counts
+        if comments is not None:
+            results_text, ticket_level_dict = self.comments_searcher(comments)
+            if results_text is not None:
+                # send results at email and attach text copy to ticket
+                attachment = self.emailer(child_ticket, email_subject, results_text, ticket_level_dict)
+                if attachment is None:
+                    # the email failed, the ticket has its results so it is left open for the next run, not alerted
+                    self.logger.error("Ticket {} is left open until its email can be sent.".format(child_ticket.key))
+                    outcome, updated = 'failed', None
+                elif self.email_batch:
+                    # attached and completed only once the queued email has gone out, see send_queued_emails
+                    return 'queued'
                 else:
-                    self.logger.warning("There are no child tickets.")
-                self.logger.info("End of parent ticket thread\n")
-        if self.results_dict:
-            self.json_file_write()
+                    outcome, updated = self.ticket_manager(child_ticket, email_subject, attachment)
+                if outcome == 'complete':
+                    # only a completed ticket's results go to the results file and history store, so a ticket left
+                    # open for the next run is not counted twice
+                    self.results_write(child_ticket.key, child_ticket.fields.parent.key, ticket_level_dict)
+            elif self.alert_missing:
+                outcome, updated = self.ticket_manager(child_ticket, email_subject, None)
+            else:
+                self.logger.info("Ticket {} has no api results yet, left for a later poll.".format(child_ticket.key))
+                return 'pending'
+            self.run_state.record(child_ticket, outcome, updated)
+            return outcome
+
+    # Runs the child ticket pipeline on a bounded thread pool, each worker thread is renamed to the ticket key it is
+    # handling so the log 'threadName' column gives per-ticket context, a failing ticket is logged and does not stop
+    # the remaining tickets. At most two tickets per worker are in flight so the stream is never read far ahead of the
+    # pool, returns the outcome of each ticket keyed by ticket key
+    #
+    def parallel_child_processor(self, child_tickets):
+        outcomes = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ttd') as executor:
+            futures = {}
+            for child_ticket in child_tickets:
+                if len(futures) >= self.max_workers * 2:
+                    done, pending = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.collect_outcome(future, futures.pop(future), outcomes)
+                futures[executor.submit(self.named_worker, child_ticket.key, self.child_ticket_processor,
+                                        child_ticket)] = child_ticket
+            for future in as_completed(futures):
+                self.collect_outcome(future, futures[future], outcomes)
+        return outcomes
+
+    # Records the outcome of a finished worker, a failure is logged against its ticket
+    #
+    def collect_outcome(self, future, child_ticket, outcomes):
+        try:
+            outcomes[child_ticket.key] = future.result()
+        except Exception as e:
+            self.logger.error("Processing failed for ticket {} => {}".format(child_ticket.key, e))
+            self.run_state.record(child_ticket, 'failed')
+            outcomes[child_ticket.key] = 'failed'
 
-    # Searches jira ticket 'comments' section for api returned counts
+    # Wraps a per ticket processor so the worker thread carries the ticket key as its name while it runs
+    #
+    def named_worker(self, ticket_key, processor, *args):
+        worker = threading.current_thread()
+        pool_name = worker.name
+        worker.name = ticket_key
+        try:
+            return processor(*args)
+        finally:
+            worker.name = pool_name
+
+    # Searches jira ticket 'comments' section for api returned counts, newest first, stopping at the first match
     #
     def comments_searcher(self, comments):
         # checks the comments for the api returned counts
-        ticket_level_dict = {}
-        for comment in comments:
-            # return value for the comment with the key == 'body', split value into a list and check the first item
-            results_text = comment.raw.get('body')
-            if results_text.split('\n')[0] == 'TradeDesk API stats:':
-                # add api returned results to a ticket level results dictionary
-                ticket_level_dict[results_text.split('\n')[1].split(':')[0]] = results_text.split('\n')[1].split(':')[1]
-                ticket_level_dict[results_text.split('\n')[2].split(':')[0]] = results_text.split('\n')[2].split(':')[1]
-                self.logger.info("{}".format(' '.join(results_text.split('\n'))))
-                return results_text, ticket_level_dict
+        results_text, ticket_level_dict = self.stats_parser.search(comments)
+        if results_text is not None:
+            self.logger.info("{}".format(' '.join(results_text.split('\n'))))
+            return results_text, ticket_level_dict
         self.logger.warning("The api returned counts have not yet posted to the comments section of ticket.")
         return None, None
 
-    # Confirm email, post as attachment to Jira ticket, 'Due' date field updated and transition to 'Complete' status
+    # Confirm email, post as attachment to Jira ticket, 'Due' date field updated and transition to 'Complete' status,
+    # returns the ticket outcome for the run state and the ticket's 'updated' timestamp when known
     #
     def ticket_manager(self, ticket, email_subject, result):
         if result is not None:
@@ -108,62 +294,142 @@ class TTDAttachmentManager(object):
                 self.logger.info("A text of the email has been added as an attachment to Ticket {}".format(ticket.key))
             except Exception as e:
                 self.logger.warning("There was a problem adding the email attachment to the ticket. {}".format(e))
+                return 'failed', None
+            try:
+                self.jira_pars.complete_ticket(ticket)
+            except Exception as e:
+                self.logger.error("There was a problem updating the 'Due' date or transitioning Ticket {} to the "
+                                  "'Complete' status => {}".format(ticket.key, e))
+                return 'failed', None
             else:
-                self.jira_pars.update_field_value(ticket)
                 self.logger.info("A 'Due' date has been added to Ticket {}".format(ticket.key))
-                self.jira_pars.progress_ticket(ticket)
                 self.logger.info("Ticket {} has been transitioned to the 'Complete' status".format(ticket.key))
+                return 'complete', None
         else:
-            self.jira_pars.add_no_results_comment(ticket)
+            updated = self.jira_pars.add_no_results_comment(ticket)
             self.logger.warning("A ticket alert has been added as a comment to Ticket {}".format(ticket.key))
+            return 'no_results', updated
 
-    # Creates the Email Manager instance, launches the emailer module and returns the sent email as a StringIO
+    # Sends (or queues, in batch mode, with the ticket's results) the email over the shared Email Manager session and
+    # returns the email as a BytesIO
     #
-    def emailer(self, ticket, email_subject, results_text):
-        cm_email = EmailManager(ticket, email_subject, self.email_to, self.email_from)
+    def emailer(self, ticket, email_subject, results_text, ticket_level_dict):
         try:
-            msg_text = cm_email.cm_emailer(results_text)
+            if self.email_batch:
+                msg_text = self.email_pars.queue_emailer(email_subject, results_text)
+            else:
+                msg_text = self.email_pars.cm_emailer(email_subject, results_text)
 
         except Exception as e:
-            self.logger.error = ("Email failed for ticket {} => {}".format(ticket.key, e))
+            self.logger.error("Email failed for ticket {} => {}".format(ticket.key, e))
 
         else:
-            attachment = StringIO()
-            # Convert email to StringIO
-            message = bytes(msg_text).decode('utf-8')
-            attachment.write(message)
-            attachment.seek(0)
-            self.logger.info("An email for ticket {} results has been sent.".format(ticket.key))
+            # Convert email to a single in-memory bytes buffer, shared by both attachment uploads
+            attachment = BytesIO(bytes(msg_text))
+            if self.email_batch:
+                with self.results_lock:
+                    self.queued_tickets.append((ticket, email_subject, msg_text, attachment, ticket_level_dict))
+                self.logger.info("An email for ticket {} results has been queued.".format(ticket.key))
+            else:
+                self.logger.info("An email for ticket {} results has been sent.".format(ticket.key))
             return attachment
 
-    # Writes the run data to a json file as a history repository and potential further processing
+    # Sends every email queued during the run over the one smtp session, then attaches, completes and writes the results
+    # of the ticket of each email that went out (on the worker pool in parallel mode), a ticket whose email failed is
+    # left open for the next run, returns the outcome of each queued ticket keyed by ticket key
+    #
+    def send_queued_emails(self):
+        failed = {id(msg) for msg in self.email_pars.send_queued()}
+        with self.results_lock:
+            queued, self.queued_tickets = self.queued_tickets, []
+        if failed:
+            self.logger.error("{} queued email(s) failed to send: {}".format(
+                len(failed), [queued_ticket[0].key for queued_ticket in queued if id(queued_ticket[2]) in failed]))
+        elif queued:
+            self.logger.info("All queued emails have been sent.")
+
+        if self.parallel_mode and queued:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ttd') as executor:
+                futures = {queued_ticket[0].key: executor.submit(self.named_worker, queued_ticket[0].key,
+                                                                 self.queued_ticket_processor, queued_ticket,
+                                                                 id(queued_ticket[2]) not in failed)
+                           for queued_ticket in queued}
+                return {ticket_key: future.result() for ticket_key, future in futures.items()}
+        return {queued_ticket[0].key: self.queued_ticket_processor(queued_ticket, id(queued_ticket[2]) not in failed)
+                for queued_ticket in queued}
+
+    # Attaches and completes the ticket of one queued email once the email was sent and the lease is still held, then
+    # writes its results, returns the ticket outcome
+    #
+    def queued_ticket_processor(self, queued_ticket, sent):
+        ticket, email_subject, msg, attachment, ticket_level_dict = queued_ticket
+        LogManager.set_ticket(ticket.key, ticket.fields.parent.key)
+        try:
+            if self.lease is not None and not self.lease.held():
+                self.logger.warning("Lease lost, ticket {} is left for the node holding it.".format(ticket.key))
+                outcome, updated = 'failed', None
+            elif not sent:
+                self.logger.error("The email for ticket {} was not sent, the ticket is left open.".format(ticket.key))
+                outcome, updated = 'failed', None
+            else:
+                outcome, updated = self.ticket_manager(ticket, email_subject, attachment)
+                if outcome == 'complete':
+                    self.results_write(ticket.key, ticket.fields.parent.key, ticket_level_dict)
+        except Exception as e:
+            self.logger.error("Processing failed for ticket {} => {}".format(ticket.key, e))
+            outcome, updated = 'failed', None
+        finally:
+            LogManager.set_ticket(None)
+        self.run_state.record(ticket, outcome, updated)
+        return outcome
+
+    # Appends one ticket's results to the run's json file and to the indexed history store as soon as it completes
+    #
+    def results_write(self, ticket_key, parent_key, ticket_level_dict):
+        with self.metrics.timer('stage.results_write'):
+            with self.results_lock:
+                results_file, run_id = self.results_file, self.run_id
+            try:
+                # json file for results repository, to be stored on zfs1/operations_mounted drive
+                results_file.append(ticket_key, ticket_level_dict)
+            except Exception as e:
+                self.logger.error("There was a problem writing the json data file or posting it to "
+                                  "/zfs1/operations_limited => {}".format(e))
+            if self.history_store:
+                self.history_store_write(run_id, ticket_key, parent_key, ticket_level_dict)
+
+    # Closes the run's json file into a complete json document
     #
     def json_file_write(self):
         try:
-            # create json file for results repository, to be stored on zfs1/operations_mounted drive
-            with open(self.results_file_name, 'w') as fp:
-                json.dump(self.results_dict, fp, indent=4)
+            count = self.results_file.finalize()
         except Exception as e:
             self.logger.error("There was a problem creating the json data file or posting it to "
                               "/zfs1/operations_limited => {}".format(e))
         else:
-            self.logger.info("The results have been posted to: {}".format(self.results_file_name))
+            if count:
+                self.logger.info("The results ({} tickets) have been posted to: {}".format(count,
+                                                                                          self.results_file_name))
 
-    # Checks the log directory for all files and removes those after a specified number of days
+    # Appends a ticket's results to the indexed results history store kept alongside the per-run json files
     #
-    def purge_files(self, purge_days, purge_dir):
+    def history_store_write(self, run_id, ticket_key, parent_key, ticket_level_dict):
         try:
-            self.logger.info("\n\t\tRemove {} days old files from the {} directory".format(purge_days, purge_dir))
-            now = time.time()
-            for file_purge in os.listdir(purge_dir):
-                f_obs_path = os.path.join(purge_dir, file_purge)
-                if os.stat(f_obs_path).st_mtime < now - int(purge_days) * 86400:
-                    time_stamp = time.strptime(time.strftime('%Y-%m-%d %H:%M:%S',
-                                                             time.localtime(os.stat(f_obs_path).st_mtime)),
-                                               '%Y-%m-%d %H:%M:%S')
-                    self.logger.info("Removing File [{}] with timestamp [{}]".format(f_obs_path, time_stamp))
-
-                    os.remove(f_obs_path)
+            if self.results_store is None:
+                self.results_store = ResultsStoreManager(self.history_file_name)
+            self.results_store.append_run(run_id, {ticket_key: ticket_level_dict}, {ticket_key: parent_key},
+                                          self.profile)
+        except Exception as e:
+            self.logger.error("There was a problem appending the results to the history store {} => {}"
+                              .format(self.history_file_name, e))
 
+    # Writes the run report of the recorded metrics as json and as a Prometheus textfile-collector file, reset starts
+    # the next report from scratch (watch mode reports every poll)
+    #
+    def metrics_report(self, json_file_name, prom_file_name, reset=False):
+        try:
+            self.metrics.write_report(json_file_name, prom_file_name, reset)
         except Exception as e:
-            self.logger.error("{}".format(e))
+            self.logger.error("There was a problem writing the metrics report => {}".format(e))
+        else:
+            self.logger.info("The run metrics have been posted to: {} and {}".format(json_file_name, prom_file_name))
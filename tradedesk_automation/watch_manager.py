@@ -0,0 +1,128 @@
+# watch_manager module
+# Module holds the class => WatchManager - manages the long-running watch (service) mode
+# Class responsible for closing child tickets within minutes of their 'TradeDesk API stats:' comment landing, rather
+# than at the next scheduled batch. Each short poll asks Jira only for child tickets updated since the previous poll
+# (less an overlap margin) and runs them through the existing TTD-AM per-ticket pipeline. Ticket events are
+# de-duplicated on key and 'updated' timestamp, tickets without api results are left for the batch run to alert, and
+# on every (re)start the full batch path runs first so nothing that changed while the service was down is missed
+# (unless a node completed the profile's run within the run window). The catch-up and every poll take the profile's
+# lease for their duration, so they never work a ticket alongside a scheduled batch run, a poll that finds the lease
+# held is simply retried on the next one. Only what the next poll could still see is remembered, and the metrics
+# report is written (and reset) after every poll, so a service that runs for weeks neither grows nor goes without a
+# run report.
+#
+from datetime import datetime, timedelta, timezone
+import threading
+import signal
+import logging
+
+
+class WatchManager(object):
+    def __init__(self, ttd_attach, poll_seconds=120, overlap_seconds=120, report=None, lease=None, run_window=None):
+        self.ttd_attach = ttd_attach
+        self.poll_seconds = poll_seconds
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.report = report    # writes and resets the metrics report, called after the catch-up and every poll
+        self.lease = lease      # the profile's lease, shared with the batch runs, taken for the catch-up and each poll
+        self.run_window = run_window
+        self.handled = {}       # ticket key => 'updated' timestamp the ticket was last handled at
+        self.stop_event = threading.Event()
+        self.logger = logging.getLogger(__name__)
+
+    # Runs the batch path once, then polls until stopped by SIGTERM/SIGINT or the stop method
+    #
+    def run(self):
+        self.install_signal_handlers()
+        last_seen = datetime.now(timezone.utc)
+        self.logger.info("Watch mode start - running the batch path to catch up")
+        if not self.leased(self.catch_up):
+            self.logger.info("The profile is being run by another node, that run covers the catch up")
+        self.write_report()
+
+        # from here on tickets are only closed when their api stats have arrived, alerts stay with the batch run
+        self.ttd_attach.alert_missing = False
+        while not self.stop_event.wait(self.poll_seconds):
+            poll_start = datetime.now(timezone.utc)
+            try:
+                polled = self.leased(self.poll, last_seen - self.overlap)
+            except Exception as e:
+                self.logger.error("Watch poll failed, it will be retried on the next poll => {}".format(e))
+            else:
+                if polled:
+                    last_seen = poll_start
+                else:
+                    self.logger.info("The profile's lease is held by another node, the poll will be retried")
+            self.write_report()
+        self.logger.info("Watch mode stopped")
+
+    # Runs a piece of work while holding the profile's lease, returns False when another node holds the lease (the work
+    # is not run) or the lease was lost while it ran (the tickets left untouched are picked up again)
+    #
+    def leased(self, work, *args):
+        if self.lease is None:
+            work(*args)
+            return True
+        if not self.lease.acquire():
+            return False
+        try:
+            work(*args)
+            held = self.lease.held()
+        finally:
+            self.lease.release()
+        return held
+
+    # The full batch path, skipped when a node completed the profile's run within the run window
+    #
+    def catch_up(self):
+        done = self.lease.completed_within(self.run_window) if self.lease is not None else None
+        if done is not None:
+            self.logger.info("The profile was run by {} at {}, no catch up needed".format(
+                done['owner'], self.lease.format_time(done['completed'])))
+            return
+        self.ttd_attach.process_manager()
+        if self.lease is not None:
+            self.lease.mark_complete()
+
+    # One incremental poll: processes the changed tickets, sends any queued emails (completing their tickets), remembers
+    # the handled ones and writes out their results
+    #
+    def poll(self, since):
+        outcomes = self.ttd_attach.process_updates(since, self.handled)
+        for ticket_key, outcome in self.ttd_attach.finish_run().items():
+            if ticket_key in outcomes:
+                outcomes[ticket_key] = (outcomes[ticket_key][0], outcome)
+        for ticket_key, (updated, outcome) in outcomes.items():
+            # failed tickets are not remembered so the next poll that sees them tries again, completed tickets have
+            # left the child status so no poll sees them again
+            if outcome not in ('failed', 'complete'):
+                self.handled[ticket_key] = updated
+        self.forget(since)
+        if outcomes:
+            self.logger.info("Watch poll since {} processed {} ticket(s): {}".format(
+                since.astimezone().strftime('%Y-%m-%d %H:%M:%S'), len(outcomes),
+                {ticket_key: outcome for ticket_key, (updated, outcome) in outcomes.items()}))
+
+    # Forgets the tickets last updated before the reach of this poll's search, later polls reach back less far so they
+    # cannot return such a ticket unchanged, which also ages out every ticket that has left the child status
+    #
+    def forget(self, since):
+        run_state = self.ttd_attach.run_state
+        reach = run_state.reach(since)
+        self.handled = {ticket_key: updated for ticket_key, updated in self.handled.items()
+                        if run_state.jira_time(updated) is not None and run_state.jira_time(updated) >= reach}
+        run_state.prune(reach)
+
+    def write_report(self):
+        if self.report is not None:
+            self.report()
+
+    def stop(self):
+        self.stop_event.set()
+
+    # SIGTERM (service stop) and SIGINT finish the current poll and exit the loop, only possible on the main thread
+    #
+    def install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signal_number, lambda signum, frame: self.stop())